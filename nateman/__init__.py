@@ -29,10 +29,10 @@ import sqlalchemy
 from flask import Flask
 from flask.logging import default_handler
 
-from . import util
+from . import migrationen, schreibsperre, stammdaten, util
 from .config_manager import config_file_exists, create_config_file, config
 from .config_manager import read_config_file
-from .models import Klausur, Klausurteilnahme, Lehrer, Schueler, Stufe, db
+from .models import Datenversion, Klausur, Klausurteilnahme, Lehrer, Schueler, Stufe, db
 
 
 def create_app() -> Flask:
@@ -68,14 +68,16 @@ def create_app() -> Flask:
         PREFERRED_URL_SCHEME="https" if config["uses-ssl"] else "http",
         SESSION_COOKIE_SECURE=config["uses-ssl"],
         MAX_CONTENT_LENGTH=16 * 1024 * 1024,  # 16 MiB upload limit
-        SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(app.instance_path, "nateman.sqlite3"),
+        SQLALCHEMY_DATABASE_URI=database_uri(app),
+        SQLALCHEMY_ENGINE_OPTIONS=engine_options(),
         SQLALCHEMY_TRACK_MODIFICATIONS=False
     )
 
     db.init_app(app)
 
     with app.app_context():
-        db.create_all()
+        schreibsperre.einrichten(app, db.engine)
+        migrationen.migrieren(app)
         init_db(app)
 
     # Blueprints registrieren
@@ -108,6 +110,33 @@ def load_config(app: Flask):
     read_config_file(app)
 
 
+def sqlite_database_path(app: Flask) -> str:
+    """ Gibt den Pfad der SQLite-Datenbank zurück, die verwendet wird, falls keine Datenbank-URI konfiguriert ist. """
+    return os.path.join(app.instance_path, "nateman.sqlite3")
+
+
+def database_uri(app: Flask) -> str:
+    """ Gibt die in der Konfiguration angegebene Datenbank-URI bzw. die URI der SQLite-Datenbank zurück. """
+    return (config.get("database") or {}).get("uri") or "sqlite:///" + sqlite_database_path(app)
+
+
+_ENGINE_OPTIONS = {
+    "pool-size": "pool_size",
+    "max-overflow": "max_overflow",
+    "pool-timeout": "pool_timeout",
+    "pool-recycle": "pool_recycle",
+    "pool-pre-ping": "pool_pre_ping",
+}
+""" Einstellungen im Abschnitt ``database`` der Konfiguration mit zugehörigem Parameter von ``create_engine`` """
+
+
+def engine_options() -> dict:
+    """ Gibt die in der Konfiguration angegebenen Einstellungen für den Verbindungspool zurück. """
+    database_config = config.get("database") or {}
+    return {option: database_config[key] for key, option in _ENGINE_OPTIONS.items()
+            if database_config.get(key) is not None}
+
+
 def read_or_generate_secret_key(app: Flask) -> bytes:
     """ Liest den Secret Key aus bzw. generiert ihn, falls noch keiner vorhanden ist. """
     secret_key_path = os.path.join(app.instance_path, "SECRET_KEY")
@@ -134,7 +163,8 @@ def configure_jinja(app: Flask):
         Stufe=Stufe,
         Schueler=Schueler,
         Lehrer=Lehrer,
-        Klausur=Klausur
+        Klausur=Klausur,
+        stammdaten=stammdaten
     )
     app.jinja_env.trim_blocks = True
     app.jinja_env.lstrip_blocks = True
@@ -167,17 +197,21 @@ def init_db(app: Flask):
         app.logger.info(f"Da keine Lehrerkonten vorhanden waren, wurde ein neues Administratorkonto erstellt. "
                         f"(Kürzel: {new_lehrer_kuerzel}; Passwort: {new_lehrer_password})")
 
+    if Datenversion.query.count() == 0:
+        db.session.add(Datenversion(id=1, version=0))
+
     db.session.commit()
 
 
 def register_blueprints(app: Flask):
     """ Registriert die Flask-Blueprints """
     from . import blueprints
-    from .blueprints import admin, auth, error, fileio, info, klausuren, schueler
+    from .blueprints import admin, auftraege, auth, error, fileio, info, klausuren, schueler
     from .blueprints.admin import lehrer as admin_lehrer
     app.register_blueprint(blueprints.bp)
     app.register_blueprint(admin.bp)
     app.register_blueprint(admin_lehrer.bp, name="admin.lehrer")
+    app.register_blueprint(auftraege.bp)
     app.register_blueprint(auth.bp)
     app.register_blueprint(error.bp)
     app.register_blueprint(fileio.bp)
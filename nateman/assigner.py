@@ -16,171 +16,319 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 # Zuordenen Methode
-from typing import List
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy
+except ImportError:
+    # NumPy ist optional, ohne wird der Konfliktgraph in reinem Python erstellt
+    numpy = None
+
+NUMPY_SCHWELLE = 16000
+""" Anzahl an Klausurteilnahmen, ab der der Konfliktgraph mit NumPy erstellt wird (siehe ``benchmark.py``) """
+
+
+class Konfliktgraph:
+    """
+    Konfliktgraph der nachzuschreibenden Klausuren.
+
+    ``kurse`` enthält die Klausurteilnahmen gruppiert nach Klausur (in der Reihenfolge des ersten Auftretens),
+    ``konflikte`` ordnet jedem Kursindex, der mindestens einen Konflikt hat, die Indizes der Kurse zu,
+    mit denen er sich Schüler teilt. ``koop`` und ``lk`` geben für jeden Kursindex an, ob der Kurs
+    Koopschüler enthält bzw. ein Leistungskurs ist.
+    """
+
+    def __init__(self, kurse: Optional[List[List]], konflikte: Dict[int, List[int]], koop: List[bool],
+                 lk: List[bool]):
+        self.kurse = kurse
+        self.konflikte = konflikte
+        self.koop = koop
+        self.lk = lk
+
+    @property
+    def anzahl(self) -> int:
+        """Anzahl der Kurse"""
+        return len(self.koop)
+
+    def kompakt(self) -> Tuple[Tuple[Tuple[int, ...], ...], Tuple[bool, ...], Tuple[bool, ...]]:
+        """
+        :return: Darstellung des Graphen ohne Klausurteilnahmen, nur aus Tupeln von Ganzzahlen und Wahrheitswerten
+            (lässt sich z.B. günstig an andere Prozesse übergeben)
+        """
+        konflikte = tuple(tuple(self.konflikte.get(i, ())) for i in range(self.anzahl))
+        return konflikte, tuple(self.koop), tuple(self.lk)
+
+    @staticmethod
+    def aus_kompakt(daten: Tuple[Tuple[Tuple[int, ...], ...], Tuple[bool, ...], Tuple[bool, ...]]) \
+            -> "Konfliktgraph":
+        """
+        Erstellt einen Konfliktgraphen ohne Klausurteilnahmen (``kurse`` ist ``None``) aus :meth:`kompakt`.
+        """
+        konflikte, koop, lk = daten
+        return Konfliktgraph(None, {i: list(n) for i, n in enumerate(konflikte) if n}, list(koop), list(lk))
+
+
+def konfliktgraph_erstellen(k_schueler: List, numpy_verwenden: Optional[bool] = None) -> Konfliktgraph:
+    """
+    Erstellt den Konfliktgraphen für die angegebenen Klausurteilnahmen.
+    Jede Teilnahme wird dabei nur einmal betrachtet, statt sie paarweise mit allen anderen zu vergleichen.
+
+    :param k_schueler: Liste der nachzuschreibenden Klausurteilnahmen. Es werden nur die Attribute ``klausur_id``,
+        ``schueler_id``, ``koop`` und ``kursname`` verwendet (siehe :class:`exporter.Exportzeile`).
+    :param numpy_verwenden: legt fest, ob die Konflikte mit NumPy berechnet werden sollen.
+        Bei ``None`` wird NumPy ab :data:`NUMPY_SCHWELLE` Teilnahmen verwendet.
+        Ist NumPy nicht installiert, wird immer reines Python verwendet.
+    :return: Konfliktgraph
+    """
+    kurse: List[List] = []
+    kurs_indizes: Dict[int, int] = {}
+    schueler_kurse: Dict[int, List[int]] = {}
+
+    # Ordnet die Schüler ihren Kursen und die Kurse ihren Schülern zu
+    for kt in k_schueler:
+        kurs_index = kurs_indizes.get(kt.klausur_id)
+        if kurs_index is None:
+            kurs_index = kurs_indizes[kt.klausur_id] = len(kurse)
+            kurse.append([])
+        kurse[kurs_index].append(kt)
+
+        schueler_kurs_liste = schueler_kurse.setdefault(kt.schueler_id, [])
+        if kurs_index not in schueler_kurs_liste:
+            schueler_kurs_liste.append(kurs_index)
+
+    if numpy_verwenden is None:
+        numpy_verwenden = len(k_schueler) >= NUMPY_SCHWELLE
+    if numpy_verwenden and numpy is not None:
+        konflikte = _konflikte_numpy(kurse, schueler_kurse)
+    else:
+        konflikte = _konflikte_python(kurse, schueler_kurse)
+
+    koop = [iscoopLk(kurs) for kurs in kurse]
+    lk = [ist_lk(kurs) for kurs in kurse]
+    return Konfliktgraph(kurse, konflikte, koop, lk)
+
+
+def _konflikte_python(kurse: List[List], schueler_kurse: Dict[int, List[int]]) -> Dict[int, List[int]]:
+    """
+    Sammelt für jeden Kurs die Kurse, mit denen er sich Schüler teilt.
+    Die Nachbarn eines Kurses sind nach seinen Schülern und dann aufsteigend nach Index geordnet.
+    """
+    for schueler_kurs_liste in schueler_kurse.values():
+        schueler_kurs_liste.sort()
+
+    konflikte: Dict[int, List[int]] = {}
+    for kurs_index, kurs in enumerate(kurse):
+        nachbarn = []
+        gesehen = set()
+        for kt in kurs:
+            for nachbar in schueler_kurse[kt.schueler_id]:
+                if nachbar != kurs_index and nachbar not in gesehen:
+                    gesehen.add(nachbar)
+                    nachbarn.append(nachbar)
+        if nachbarn:
+            konflikte[kurs_index] = nachbarn
+
+    return konflikte
+
+
+def _konflikte_numpy(kurse: List[List], schueler_kurse: Dict[int, List[int]]) -> Dict[int, List[int]]:
+    """
+    Wie :func:`_konflikte_python`, berechnet die Konflikte aber als Matrixprodukt AᵀA
+    der Schüler×Kurs-Inzidenzmatrix A.
+    """
+    schueler_indizes = {schueler_id: i for i, schueler_id in enumerate(schueler_kurse)}
+    mitglieder = [[schueler_indizes[kt.schueler_id] for kt in kurs] for kurs in kurse]
+
+    # float32, damit das Matrixprodukt über BLAS berechnet wird (bool-Matrizen werden ohne BLAS multipliziert)
+    inzidenz = numpy.zeros((len(schueler_indizes), len(kurse)), dtype=numpy.float32)
+    for kurs_index, kurs_mitglieder in enumerate(mitglieder):
+        inzidenz[kurs_mitglieder, kurs_index] = 1
+
+    gemeinsam = (inzidenz.T @ inzidenz) > 0
+    numpy.fill_diagonal(gemeinsam, False)
+
+    konflikte: Dict[int, List[int]] = {}
+    for kurs_index in numpy.flatnonzero(gemeinsam.any(axis=1)):
+        nachbarn = numpy.flatnonzero(gemeinsam[kurs_index])
+        # Reihenfolge wie in _konflikte_python: zuerst nach dem ersten gemeinsamen Schüler, dann nach Index
+        erster_schueler = inzidenz[numpy.ix_(mitglieder[kurs_index], nachbarn)].argmax(axis=0)
+        konflikte[int(kurs_index)] = nachbarn[numpy.lexsort((nachbarn, erster_schueler))].tolist()
+
+    return konflikte
 
 
 def iscoopLk(kurs: List):
     for k in kurs:
-        if k.schueler.koop:
+        if k.koop:
             return True
     return False
 
 
-def zuordnen(k_schueler):
-    # initziert Variablen
-    termin_1_kurse: [int, int] = []
-    termin_2_kurse: [int, int] = []
-
-    probleme_kurse = []
+def ist_lk(kurs: List) -> bool:
+    """
+    :param kurs: Klausurteilnahmen eines Kurses
+    :return: ``True``, falls der Kurs ein Leistungskurs ist (z.B. ``D-L1``), ``False``, falls nicht
+    """
+    kursname = kurs[0].kursname
+    return len(kursname) >= 2 and kursname[-2] == "L"
 
-    termin_1_kurse_s = []
-    termin_2_kurse_s = []
-    probleme_kurse_s = []
 
-    if len(k_schueler) != 0:
-        s_list = [[k_schueler.pop(0)]]
+def _runde(graph: Konfliktgraph, aktive: List[int]) -> Tuple[List[int], List[int], List[int]]:
+    """
+    Führt eine Runde der Termin-1/Termin-2-Zuordnung für die angegebenen Kurse durch.
 
-        # Ordnet die Schüler den ihren Kursen zu
-        i = 0
+    :param graph: Konfliktgraph aller Kurse
+    :param aktive: aufsteigend sortierte Indizes der in dieser Runde zuzuordnenden Kurse
+    :return: Indizes der Kurse für Termin 1, für Termin 2 und der Problemkurse
+    """
+    # Innerhalb der Runde wird mit den Positionen in ``aktive`` gearbeitet
+    positionen = {kurs: i for i, kurs in enumerate(aktive)}
+    dic: Dict[int, List[int]] = {}
+    for i, kurs in enumerate(aktive):
+        nachbarn = [positionen[n] for n in graph.konflikte.get(kurs, ()) if n in positionen]
+        if nachbarn:
+            dic[i] = nachbarn
 
-        for s in k_schueler:
-            while i < len(s_list):
-                if s.klausur.id == s_list[i][0].klausur.id:
-                    s_list[i].append(s)
-                    break
-                i += 1
-            else:
-                s_list.append([s])
-            i = 0
-        del i
+    # initziert Variablen
+    termin_1_kurse: List[int] = []
+    termin_2_kurse: List[int] = []
 
-        # Findet und speichert die Konflikte in ein Dictionary
-        h_list = []
+    probleme_kurse: List[int] = []
 
-        dic = {}
+    if dic:
 
+        # Fügt die LKs Termin 1 zu
         i = 0
-        i2 = 0
-        i3 = 0
-        i4 = 0
-
-        while i < len(s_list):
-            while i2 < len(s_list[i]):
-                while i3 < len(s_list):
-                    while i4 < len(s_list[i3]):
-                        if s_list[i][i2].schueler == s_list[i3][i4].schueler and i != i3 and str(i3) not in h_list:
-                            h_list.append(str(i3))
-                        i4 += 1
-                    i3 += 1
-                    i4 = 0
-                i2 += 1
-                i3 = 0
-            if h_list:
-                dic[str(i)] = h_list
-                h_list = []
-            i += 1
-            i2 = 0
 
-        del i
-        del i2
-        del i3
-        del i4
-
-        if dic != {}:
-
-            # Fügt die LKs Termin 1 zu
-            i = 0
-
-            while i < len(s_list):
-                if iscoopLk(s_list[i]) and str(i) in dic:
-                    termin_1_kurse.append(str(i))
-                i += 1
-
-            while i < len(s_list):
-                if s_list[i][0].klausur.kursname[-2] == "L" and str(i) not in termin_1_kurse and str(i) in dic:
-                    termin_1_kurse.append(str(i))
-                i += 1
+        while i < len(aktive):
+            if graph.koop[aktive[i]] and i in dic:
+                termin_1_kurse.append(i)
+            i += 1
 
-            del i
+        while i < len(aktive):
+            if graph.lk[aktive[i]] and i not in termin_1_kurse and i in dic:
+                termin_1_kurse.append(i)
+            i += 1
 
-            # Ordnet die LKs Fest ein
+        # Ordnet die LKs Fest ein. Wie bisher wird dabei die Position i statt des Kurses mit Termin 2 verglichen.
+        # Bricht das ab (der zu entfernende Kurs ist nicht in Termin 1, bisher ein ValueError), wird die Einordnung
+        # wiederholt und stattdessen der Kurs selbst verglichen.
+        vorrang_kurse = termin_1_kurse
+        for kurs_vergleichen in (False, True):
+            termin_1_kurse = list(vorrang_kurse)
+            termin_2_kurse = []
             i = 0
 
             while i < len(termin_1_kurse):
-                if str(i) not in termin_2_kurse:
+                vergleich = termin_1_kurse[i] if kurs_vergleichen else i
+                if vergleich not in termin_2_kurse:
                     for kurs in dic[termin_1_kurse[i]]:
                         if not (kurs in termin_2_kurse):
                             termin_2_kurse.append(kurs)
                     i += 1
+                elif vergleich in termin_1_kurse:
+                    termin_1_kurse.remove(vergleich)
                 else:
-                    termin_1_kurse.remove(str(i))
+                    break
+            else:
+                break
 
-            i2 = 0
+        i2 = 0
 
-            if not termin_1_kurse:
-                for d in dic:
-                    termin_1_kurse.append(d)
-                    break
+        if not termin_1_kurse:
+            termin_1_kurse.append(next(iter(dic)))
 
-            # Füllt die Termine
-            finished = False
-            while not finished:
-                while not (i >= len(termin_1_kurse) and i2 >= len(termin_2_kurse)):
-                    if i < len(termin_1_kurse):
+        # Füllt die Termine
+        finished = False
+        while not finished:
+            while not (i >= len(termin_1_kurse) and i2 >= len(termin_2_kurse)):
+                if i < len(termin_1_kurse):
+                    for kurs in dic[termin_1_kurse[i]]:
+                        if kurs in termin_1_kurse[:i]:
+                            probleme_kurse.append(termin_1_kurse.pop(i))
+                            break
+                    else:
                         for kurs in dic[termin_1_kurse[i]]:
-                            if kurs in termin_1_kurse[:i]:
-                                probleme_kurse.append(termin_1_kurse.pop(i))
-                                break
-                        else:
-                            for kurs in dic[termin_1_kurse[i]]:
-                                if not (kurs in termin_2_kurse):
-                                    termin_2_kurse.append(kurs)
-                            i += 1
-
-                    if i2 < len(termin_2_kurse):
+                            if not (kurs in termin_2_kurse):
+                                termin_2_kurse.append(kurs)
+                        i += 1
+
+                if i2 < len(termin_2_kurse):
+                    for kurs in dic[termin_2_kurse[i2]]:
+                        if kurs in termin_2_kurse[:i2]:
+                            probleme_kurse.append(termin_2_kurse.pop(i2))
+                            break
+                    else:
                         for kurs in dic[termin_2_kurse[i2]]:
-                            if kurs in termin_2_kurse[:i2]:
-                                probleme_kurse.append(termin_2_kurse.pop(i2))
-                                break
-                        else:
-                            for kurs in dic[termin_2_kurse[i2]]:
-                                if not (kurs in termin_1_kurse):
-                                    termin_1_kurse.append(kurs)
-                            i2 += 1
-                probleme_kurse = list(set(probleme_kurse))
-
-                for kurs in dic:
-                    if kurs not in termin_1_kurse and kurs not in termin_2_kurse \
-                            and kurs not in probleme_kurse:
-                        termin_2_kurse.append(kurs)
-                        break
-                else:
-                    finished = True
+                            if not (kurs in termin_1_kurse):
+                                termin_1_kurse.append(kurs)
+                        i2 += 1
+            probleme_kurse = sorted(set(probleme_kurse))
+
+            for kurs in dic:
+                if kurs not in termin_1_kurse and kurs not in termin_2_kurse \
+                        and kurs not in probleme_kurse:
+                    termin_2_kurse.append(kurs)
+                    break
+            else:
+                finished = True
 
-        # Ordnet die nicht problematischen Kurse zu
+    # Ordnet die nicht problematischen Kurse zu
+    for i in range(len(aktive)):
+        if i not in termin_1_kurse and i not in termin_2_kurse and i not in probleme_kurse:
+            termin_1_kurse.append(i)
+
+    return ([aktive[i] for i in termin_1_kurse], [aktive[i] for i in termin_2_kurse],
+            [aktive[i] for i in probleme_kurse])
+
+
+def termine_berechnen(graph: Konfliktgraph, max_termine: Optional[int] = None) -> Tuple[List[List[int]], List[int]]:
+    """
+    Ordnet die Kurse des Konfliktgraphen Terminen zu.
+    Die Problemkurse einer Runde werden in der nächsten Runde auf zwei weitere Termine verteilt,
+    bis keine Problemkurse mehr übrig sind oder ``max_termine`` erreicht ist.
+
+    :param graph: Konfliktgraph
+    :param max_termine: maximale Anzahl an Terminen (``None`` für unbegrenzt)
+    :return: Kursindizes je Termin und Indizes der Kurse, die keinem Termin zugeordnet werden konnten
+    """
+    termine: List[List[int]] = []
+    aktive = list(range(graph.anzahl))
+
+    # In jeder Runde landet mindestens ein Kurs in Termin 1, daher endet die Schleife spätestens nach n Runden
+    while aktive:
+        if max_termine is not None and len(termine) >= max_termine:
+            break
+
+        termin_1_kurse, termin_2_kurse, aktive = _runde(graph, aktive)
+        termine.append(termin_1_kurse)
+        termine.append(termin_2_kurse)
+
+    if max_termine is not None and len(termine) > max_termine:
+        # Der zweite Termin der letzten Runde passt nicht mehr
+        ueberzaehlig = set(termine.pop()).difference(*termine)
+        aktive = sorted(ueberzaehlig.union(aktive))
+
+    return termine, aktive
 
-        i = 0
-        while i < len(s_list):
-            if str(i) not in termin_1_kurse and str(i) not in termin_2_kurse and str(i) not in probleme_kurse:
-                termin_1_kurse.append(str(i))
-            i += 1
 
-        for kurs in termin_1_kurse:
-            for s in s_list[int(kurs)]:
-                termin_1_kurse_s.append(s)
+def zuordnen(k_schueler, graph: Optional[Konfliktgraph] = None, max_termine: Optional[int] = None):
+    """
+    Ordnet die nachzuschreibenden Klausurteilnahmen Nachschreibterminen zu.
+    Teilnahmen an Kursen, die innerhalb von ``max_termine`` Terminen nicht zugeordnet werden konnten,
+    sind in keinem Termin enthalten.
 
-        for kurs in termin_2_kurse:
-            for s in s_list[int(kurs)]:
-                termin_2_kurse_s.append(s)
+    :param k_schueler: Liste der nachzuschreibenden Klausurteilnahmen
+    :param graph: bereits erstellter Konfliktgraph für ``k_schueler`` (wird sonst erstellt)
+    :param max_termine: maximale Anzahl an Terminen (``None`` für unbegrenzt)
+    :return: Liste von Terminen mit den jeweils zugeordneten Klausurteilnahmen
+    """
+    if len(k_schueler) == 0:
+        return None
 
-        for kurs in probleme_kurse:
-            for s in s_list[int(kurs)]:
-                probleme_kurse_s.append(s)
+    if graph is None:
+        graph = konfliktgraph_erstellen(k_schueler)
 
-        k_schueler.insert(0, s_list[0][0])
+    termine, _ = termine_berechnen(graph, max_termine)
 
-        # Ruft die Methode rekursiv auf bis keine Problemkurse vorhanden sind
-        if not probleme_kurse_s:
-            return [termin_1_kurse_s, termin_2_kurse_s]
-        else:
-            return [termin_1_kurse_s] + [termin_2_kurse_s] + zuordnen(probleme_kurse_s)
+    return [[kt for kurs in termin for kt in graph.kurse[kurs]] for termin in termine]
@@ -0,0 +1,113 @@
+# NateMan – Nachschreibtermin-Manager
+# auftraege.py
+# Copyright © 2020  Niklas Elsbrock und Johannes Bingel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Führt länger dauernde Vorgänge (Import, Export, Versand von Erinnerungsemails) als Aufträge in einem Threadpool
+im Hintergrund aus, damit die Anfrage sofort beantwortet werden kann. Status und Fortschritt stehen in der Tabelle
+der :class:`models.Auftrag`-Einträge.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from flask import Flask, current_app
+
+from . import util
+from .config_manager import config
+from .models import Auftrag, Lehrer, db
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _threadpool() -> ThreadPoolExecutor:
+    """
+    :return: Threadpool, in dem die Aufträge ausgeführt werden (wird beim ersten Auftrag erstellt)
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=(config.get("auftraege") or {}).get("threads", 2),
+                                       thread_name_prefix="nateman_auftrag")
+        return _pool
+
+
+def max_dauer() -> timedelta:
+    """
+    :return: Zeit, nach der ein nicht beendeter Auftrag als abgebrochen gilt (``auftraege.max-dauer``)
+    """
+    return timedelta(minutes=(config.get("auftraege") or {}).get("max-dauer", 60))
+
+
+def starten(art: str, lehrer: Optional[Lehrer], funktion: Callable[..., None], *args) -> Auftrag:
+    """
+    Legt einen neuen Auftrag an und führt ihn im Hintergrund aus.
+
+    Die Funktion wird mit dem Auftrag und ``args`` in einem eigenen Anwendungskontext aufgerufen. Sie meldet ihren
+    Fortschritt mit :meth:`Auftrag.fortschritt_melden`, schließt den Auftrag mit :meth:`Auftrag.abschliessen` ab und
+    speichert dabei selbst ihre Änderungen (``db.session.commit()``). Löst sie eine Ausnahme aus, gilt der Auftrag als
+    fehlgeschlagen.
+
+    :param art: Art des Auftrags (z.B. ``"import"``)
+    :param lehrer: Lehrer, der den Auftrag gestartet hat
+    :param funktion: auszuführende Funktion
+    :return: neuer Auftrag
+    """
+    # Abgebrochene Aufträge beenden und abgelaufene Aufträge samt ihrer Ergebnisdateien entfernen
+    Auftrag.abgebrochene_beenden(max_dauer())
+    Auftrag.cleanup()
+
+    auftrag = Auftrag(id=util.random_uri_safe_string(32), art=art, lehrer=lehrer, status=Auftrag.WARTEND,
+                      fortschritt=0.0, erstellt=datetime.utcnow())
+    db.session.add(auftrag)
+    db.session.commit()
+
+    _threadpool().submit(_ausfuehren, current_app._get_current_object(), auftrag.id, funktion, args)
+
+    return auftrag
+
+
+def _ausfuehren(app: Flask, auftrag_id: str, funktion: Callable[..., None], args: tuple) -> None:
+    with app.app_context():
+        auftrag = Auftrag.query.filter_by(id=auftrag_id).first()
+        try:
+            funktion(auftrag, *args)
+            if not auftrag.ist_beendet():
+                auftrag.abschliessen("Der Auftrag wurde abgeschlossen.")
+                db.session.commit()
+        except Exception as exc:
+            db.session.rollback()
+            app.logger.error(f"Beim Ausführen des Auftrags {auftrag_id} ({auftrag.art}) ist ein Fehler aufgetreten.",
+                             exc_info=exc)
+
+            auftrag.abschliessen(f"Beim Ausführen des Auftrags ist ein unerwarteter Fehler aufgetreten.\n\n"
+                                 f"Fehlerbeschreibung: {type(exc).__name__}\n{exc}", "error")
+            db.session.commit()
+
+
+def ergebnis_pfad(auftrag: Auftrag, endung: str) -> str:
+    """
+    :param auftrag: Auftrag
+    :param endung: Dateiendung (z.B. ``".xlsx"``)
+    :return: Pfad, unter dem die Ergebnisdatei des Auftrags gespeichert wird
+    """
+    ordner = os.path.join(current_app.instance_path, "auftraege")
+    os.makedirs(ordner, exist_ok=True)
+    return os.path.join(ordner, auftrag.id + endung)
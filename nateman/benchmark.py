@@ -0,0 +1,153 @@
+# NateMan – Nachschreibtermin-Manager
+# benchmark.py
+# Copyright © 2020  Niklas Elsbrock und Johannes Bingel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Enthält Benchmarks für die Zuordnung der Nachschreibtermine.
+Aufruf: ``nateman benchmark`` (Terminzuordnung) bzw. ``nateman benchmark-konfliktgraph`` (NumPy-Crossover)
+"""
+
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+from . import assigner, scheduler
+
+
+class _Klausurteilnahme:
+    """Ersatz für :class:`exporter.Exportzeile` mit den Attributen, die die Zuordnung verwendet."""
+
+    __slots__ = ("klausur_id", "schueler_id", "koop", "kursname")
+
+    def __init__(self, klausur_id: int, schueler_id: int, koop: bool, kursname: str):
+        self.klausur_id = klausur_id
+        self.schueler_id = schueler_id
+        self.koop = koop
+        self.kursname = kursname
+
+
+def synthetische_stufe(schueler_anzahl: int = 120, kurse_pro_schueler: int = 10, lk_anteil: float = 0.25,
+                       koop_anteil: float = 0.05, versaeumnisquote: float = 0.1, kursgroesse: int = 20,
+                       seed: int = 0) -> List[_Klausurteilnahme]:
+    """
+    Erzeugt die nachzuschreibenden Klausurteilnahmen einer zufälligen Stufe.
+
+    :param schueler_anzahl: Anzahl der Schüler
+    :param kurse_pro_schueler: Anzahl der Kurse, die jeder Schüler belegt
+    :param lk_anteil: Anteil der Leistungskurse an allen Kursen
+    :param koop_anteil: Anteil der Koopschüler
+    :param versaeumnisquote: Anteil der Klausurteilnahmen, die versäumt wurden
+    :param kursgroesse: durchschnittliche Anzahl an Schülern pro Kurs
+    :param seed: Startwert des Zufallsgenerators
+    :return: Liste der versäumten Klausurteilnahmen
+    """
+    rnd = random.Random(seed)
+
+    kurs_anzahl = max(kurse_pro_schueler, -(-schueler_anzahl * kurse_pro_schueler // kursgroesse))
+    lk_anzahl = round(kurs_anzahl * lk_anteil)
+    kursnamen = [f"K{k}-{'L' if k < lk_anzahl else 'G'}1" for k in range(kurs_anzahl)]
+
+    teilnahmen = []
+    for schueler_id in range(schueler_anzahl):
+        koop = rnd.random() < koop_anteil
+        for klausur_id in rnd.sample(range(kurs_anzahl), kurse_pro_schueler):
+            if rnd.random() < versaeumnisquote:
+                teilnahmen.append(_Klausurteilnahme(klausur_id, schueler_id, koop, kursnamen[klausur_id]))
+
+    rnd.shuffle(teilnahmen)
+    return teilnahmen
+
+
+def zuordnung_messen(k_schueler: List, strategien: Optional[List[scheduler.Strategie]] = None) -> Dict:
+    """
+    Misst die Erstellung des Konfliktgraphen und die Terminzuordnung der angegebenen Strategien getrennt.
+    Jede Strategie färbt vor der Messung einmal einen leeren Graphen, damit z.B. der Start des Prozesspools von
+    :class:`scheduler.PortfolioStrategie` nicht mitgemessen wird.
+
+    :param k_schueler: Liste der nachzuschreibenden Klausurteilnahmen
+    :param strategien: zu messende Strategien (Voreinstellung: alle Strategien außer ``portfolio`` mit
+        Standardparametern)
+    :return: Dictionary mit Größe des Graphen, Zeiten in Sekunden und Anzahl der Termine je Strategie
+    """
+    if strategien is None:
+        strategien = [strategie() for name, strategie in scheduler.STRATEGIEN.items()
+                      if name != scheduler.PortfolioStrategie.name]
+
+    start = time.perf_counter()
+    graph = assigner.konfliktgraph_erstellen(k_schueler)
+    graph_zeit = time.perf_counter() - start
+
+    ergebnis = {
+        "teilnahmen": len(k_schueler),
+        "kurse": graph.anzahl,
+        "konflikte": sum(len(nachbarn) for nachbarn in graph.konflikte.values()) // 2,
+        "konfliktgraph_sekunden": graph_zeit,
+        "strategien": {},
+    }
+
+    leerer_graph = assigner.konfliktgraph_erstellen([])
+    for strategie in strategien:
+        with strategie:
+            strategie.faerben(leerer_graph, {})
+
+            start = time.perf_counter()
+            farben = strategie.faerben(graph, scheduler.vorgabe_erstellen(graph))
+            zeit = time.perf_counter() - start
+
+        ergebnis["strategien"][strategie.schluessel()] = {
+            "sekunden": zeit,
+            "termine": max(farben, default=-1) + 1,
+        }
+
+    return ergebnis
+
+
+def _zeit(k_schueler: List, numpy_verwenden: bool, wiederholungen: int) -> float:
+    start = time.perf_counter()
+    for _ in range(wiederholungen):
+        assigner.konfliktgraph_erstellen(k_schueler, numpy_verwenden)
+    return (time.perf_counter() - start) / wiederholungen
+
+
+def konfliktgraph_crossover(kurs_anzahl: int = 40, kurse_pro_schueler: int = 10, versaeumnisquote: float = 0.5,
+                            wiederholungen: int = 3) -> Tuple[List[Tuple[int, float, float]], Optional[int]]:
+    """
+    Vergleicht die Erstellung des Konfliktgraphen in reinem Python und mit NumPy bei wachsender Schülerzahl.
+
+    :return: Liste von (Anzahl Teilnahmen, Zeit Python, Zeit NumPy) und die kleinste Anzahl an Teilnahmen,
+        ab der NumPy bei allen größeren Eingaben schneller war (``None``, falls nie)
+    """
+    if assigner.numpy is None:
+        raise RuntimeError("NumPy is not installed")
+
+    ergebnisse = []
+    schueler_anzahl = 25
+    while schueler_anzahl <= 12800:
+        k_schueler = synthetische_stufe(schueler_anzahl, kurse_pro_schueler, versaeumnisquote=versaeumnisquote,
+                                        kursgroesse=max(1, schueler_anzahl * kurse_pro_schueler // kurs_anzahl))
+        zeit_python = _zeit(k_schueler, False, wiederholungen)
+        zeit_numpy = _zeit(k_schueler, True, wiederholungen)
+        ergebnisse.append((len(k_schueler), zeit_python, zeit_numpy))
+        schueler_anzahl *= 2
+
+    crossover = None
+    for anzahl, zeit_python, zeit_numpy in reversed(ergebnisse):
+        if zeit_numpy >= zeit_python:
+            break
+        crossover = anzahl
+
+    return ergebnisse, crossover
+
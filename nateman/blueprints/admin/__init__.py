@@ -23,7 +23,8 @@ from flask import Blueprint, flash, g, redirect, render_template, request, url_f
 from sqlalchemy.exc import StatementError
 
 from ..auth import admin_required
-from ...models import db
+from ... import auftraege, emails, stammdaten
+from ...models import db, Auftrag
 
 bp = Blueprint("admin", __name__, url_prefix="/admin")
 
@@ -35,6 +36,27 @@ def index():
     return render_template("admin/index.html.j2")
 
 
+@bp.route("/reminder-mails", methods=("POST",))
+@admin_required
+def reminder_mails():
+    """ Startet den Versand der Erinnerungsemails im Hintergrund """
+    auftrag = auftraege.starten("erinnerungsemails", g.lehrer, _reminder_mails_ausfuehren)
+    current_app.logger.info(f"{g.lehrer} hat den Versand von Erinnerungsemails gestartet.")
+    return redirect(url_for("auftraege.auftrag", auftrag_id=auftrag.id), code=303)
+
+
+def _reminder_mails_ausfuehren(auftrag: Auftrag):
+    """Sendet die Erinnerungsemails und meldet dabei den Fortschritt des Auftrags"""
+    fail_count = emails.send_reminder_mails(auftrag.fortschritt_melden)
+
+    if fail_count == 0:
+        auftrag.abschliessen("Die Erinnerungsemails wurden versandt.")
+    else:
+        auftrag.abschliessen(f"Die Erinnerungsemails wurden versandt. {fail_count} E-Mail(s) konnten nicht versandt "
+                             f"werden, da keine bestätigte E-Mail-Adresse eingetragen ist.", "warning")
+    db.session.commit()
+
+
 @bp.route("/sql-access", methods=("GET", "POST"))
 @admin_required
 def sql_access():
@@ -60,6 +82,8 @@ def sql_access():
         return render_template("admin/sql_access.html.j2", query=query, result=None)
 
     if not result.returns_rows:
+        # Die Abfrage kann Stufen oder Lehrer geändert haben
+        stammdaten.datenversion_erhoehen()
         db.session.commit()
 
     logged_query = query.replace('\r\n', ' ').replace('\n', ' ')
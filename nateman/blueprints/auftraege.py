@@ -0,0 +1,97 @@
+# NateMan – Nachschreibtermin-Manager
+# blueprints/auftraege.py
+# Copyright © 2020  Niklas Elsbrock
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Blueprint für im Hintergrund ausgeführte Aufträge (Fortschrittsanzeige und Ergebnis)
+"""
+
+from flask import Blueprint, abort, flash, g, jsonify, redirect, render_template, send_file, url_for
+
+from .auth import login_required
+from .. import auftraege
+from ..models import Auftrag, db
+
+bp = Blueprint("auftraege", __name__, url_prefix="/auftraege")
+
+_TITEL = {
+    "import": "Klausurpläne importieren",
+    "export": "Nachschreibplan exportieren",
+    "erinnerungsemails": "Erinnerungsemails versenden",
+}
+""" Seitentitel je Art des Auftrags """
+
+_RUECKSPRUNG = {
+    "import": "fileio.import",
+    "erinnerungsemails": "admin.index",
+}
+""" Endpunkt je Art des Auftrags, zu dem nach dem Ende des Auftrags weitergeleitet wird """
+
+
+def _auftrag_laden(auftrag_id: str) -> Auftrag:
+    """
+    :return: Auftrag mit der angegebenen ID; bricht mit 404 ab, falls er nicht existiert oder nicht vom angemeldeten
+        Lehrer gestartet wurde (außer für Administratoren). Ein abgebrochener Auftrag (siehe
+        :meth:`models.Auftrag.abgebrochene_beenden`) wird dabei als fehlgeschlagen markiert.
+    """
+    auftrag = Auftrag.query.filter_by(id=auftrag_id).first()
+    if auftrag is None or (auftrag.lehrer_id != g.lehrer.id and not g.lehrer.is_admin):
+        abort(404)
+
+    # ELSE
+
+    if auftrag.ist_abgebrochen(auftraege.max_dauer()):
+        auftrag.abschliessen(Auftrag.ABGEBROCHEN_MELDUNG, "error")
+        db.session.commit()
+
+    return auftrag
+
+
+@bp.route("/<auftrag_id>")
+@login_required
+def auftrag(auftrag_id: str):
+    """ Fortschrittsanzeige eines Auftrags """
+    auftrag_ = _auftrag_laden(auftrag_id)
+    return render_template("auftraege/auftrag.html.j2", auftrag=auftrag_, titel=_TITEL.get(auftrag_.art, "Auftrag"))
+
+
+@bp.route("/<auftrag_id>/status")
+@login_required
+def status(auftrag_id: str):
+    """ Status eines Auftrags als JSON (wird von der Fortschrittsanzeige regelmäßig abgefragt) """
+    auftrag_ = _auftrag_laden(auftrag_id)
+    return jsonify(status=auftrag_.status, fortschritt=auftrag_.fortschritt, schritt=auftrag_.schritt,
+                   beendet=auftrag_.ist_beendet(), datei=auftrag_.ergebnis_datei is not None)
+
+
+@bp.route("/<auftrag_id>/ergebnis")
+@login_required
+def ergebnis(auftrag_id: str):
+    """ Ergebnis eines beendeten Auftrags: Download der Ergebnisdatei oder Weiterleitung mit der Meldung """
+    auftrag_ = _auftrag_laden(auftrag_id)
+
+    if not auftrag_.ist_beendet():
+        return redirect(url_for(".auftrag", auftrag_id=auftrag_.id), code=303)
+
+    # ELSE
+
+    if auftrag_.ergebnis_datei is not None:
+        return send_file(auftrag_.ergebnis_datei, as_attachment=True, download_name=auftrag_.ergebnis_name)
+
+    # ELSE
+
+    flash(auftrag_.meldung, auftrag_.meldung_kategorie)
+    return redirect(url_for(_RUECKSPRUNG.get(auftrag_.art, "index.index")), code=303)
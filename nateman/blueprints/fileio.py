@@ -18,44 +18,54 @@
 """
 Export- und Import-Blueprint
 """
+import contextlib
 import os
 import tempfile
 from datetime import datetime
-from pyexpat import ExpatError
+from typing import List, Optional, Tuple
+from xml.etree.ElementTree import ParseError
 
 from flask import abort, Blueprint, current_app, g, redirect, url_for, flash, request, render_template
 from openpyxl.utils.exceptions import InvalidFileException
 
 from .auth import beratungslehrer_required, admin_required
-from .. import exporter, util
-from ..importer import KlausurplanImportError, import_kurs42, import_excel_koop, KoopSchuelerImportError, import_csv
-from ..models import db, Stufe, Klausur, Schueler
+from .. import auftraege, exporter, util
+from ..importer import datei_hash, KlausurplanImportError, import_excel_koop, KoopSchuelerImportError, \
+    lehrer_pwd_hash, Planaenderungen, plaene_lesen, plan_abgleichen
+from ..models import db, Auftrag, Stufe, Klausur, Schueler
 
 bp = Blueprint("fileio", __name__)
 
 
-@bp.route("/export")
+@bp.route("/export", methods=("POST",))
 @beratungslehrer_required
 def export():
-    """ Export (Seite *Nachschreibplan exportieren*)"""
-    with tempfile.NamedTemporaryFile(prefix="nateman_export_") as fp:
-        exporter.excelexport(fp.name, g.lehrer.accessible_stufen())
-        # XLSX-Datei wird in ``filebytes`` geladen, damit die temporäre Datei gelöscht werden kann
-        fp.seek(0)
-        filebytes = fp.read()
+    """ Export (Seite *Nachschreibplan exportieren*); der Export wird im Hintergrund erstellt """
+    auftrag = auftraege.starten("export", g.lehrer, _export_ausfuehren, g.lehrer.accessible_stufen(names=True))
+    return redirect(url_for("auftraege.auftrag", auftrag_id=auftrag.id), code=303)
 
-    download_name = "NateMan-Export " + datetime.now().strftime("%Y-%m-%d") + ".xlsx"
-    xlsx_mimetype = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    response = current_app.response_class(filebytes, mimetype=xlsx_mimetype)
-    response.headers.set("Content-Disposition", "attachment", filename=download_name)
 
-    return response
+def _export_ausfuehren(auftrag: Auftrag, stufen_namen: Tuple[str, ...]):
+    """Erstellt den Nachschreibplan für die angegebenen Stufen als Ergebnisdatei des Auftrags"""
+    stufen = Stufe.query.filter(Stufe.name.in_(stufen_namen)).all()
+
+    def fortschritt(anteil: float, schritt: str):
+        # Bereits berechnete Terminzuordnungen speichern, damit die Datenbank nicht gesperrt bleibt
+        db.session.commit()
+        auftrag.fortschritt_melden(anteil, schritt)
+
+    pfad = auftraege.ergebnis_pfad(auftrag, ".xlsx")
+    exporter.excelexport(pfad, stufen, fortschritt)
+
+    download_name = "NateMan-Export " + datetime.now().strftime("%Y-%m-%d") + ".xlsx"
+    auftrag.abschliessen("Nachschreibplan exportiert.", ergebnis_datei=pfad, ergebnis_name=download_name)
+    db.session.commit()
 
 
 @bp.route("/import", methods=("GET", "POST"), endpoint="import")
 @admin_required
 def import_():
-    """ Import (Seite *Klausurpläne importieren*) """
+    """ Import (Seite *Klausurpläne importieren*); die Pläne werden im Hintergrund importiert """
     if request.method != "POST":
         return render_template("fileio/import.html.j2")
 
@@ -87,78 +97,157 @@ def import_():
         flash(error_msg, "error")
         return redirect(url_for(".import"), code=303)
 
-    plan_given = []
+    # Bei einer Vorschau werden alle Änderungen am Ende verworfen
+    vorschau = "vorschau" in request.form
 
+    # Die hochgeladenen Dateien werden gespeichert, da sie nach dem Ende der Anfrage nicht mehr verfügbar sind
+    plan_dateien = []
     for stufe in all_stufen:
         plan = request.files.get("plan_" + stufe.name, None)
-
-        # Klausurplan importieren
         if plan and plan.filename:
-            plan_given.append(stufe.name)
+            plan_dateien.append((_upload_speichern(plan, "nateman_plan_import_"), plan.filename, stufe.name))
 
-            _del_plan(stufe)
+    ks_file = request.files.get("koopschueler", None)
+    ks_datei = None
+    if ks_file and ks_file.filename:
+        ks_datei = _upload_speichern(ks_file, "nateman_ks_import_", os.path.splitext(ks_file.filename)[1])
+
+    if len(plan_dateien) == 0 and ks_datei is None:
+        flash("Es wurden keine Pläne angegeben.", "error")
+        return redirect(url_for(".import"), code=303)
+
+    # ELSE
 
-            if plan.filename.endswith(".xml"):
-                import_func = import_kurs42
-            else:
-                import_func = import_csv
+    auftrag = auftraege.starten("import", g.lehrer, _import_ausfuehren, str(g.lehrer), plan_dateien,
+                                new_lehrer_password, vorschau, ks_datei)
+    return redirect(url_for("auftraege.auftrag", auftrag_id=auftrag.id), code=303)
 
-            try:
-                import_func(plan, stufe, new_lehrer_password)
-            except (KeyError, ValueError, ExpatError, KlausurplanImportError) as exc:
-                db.session.rollback()
 
-                flash(f"Beim Importieren des Klausurplans für die {stufe.name} ist ein Fehler aufgetreten.\n"
-                      f"Wahrscheinlich ist die Klausurplandatei ungültig oder es gibt einen Konflikt mit den "
-                      f"bisherigen Daten.\n\nFehlerbeschreibung: {type(exc).__name__}\n{exc}", "error")
+def _upload_speichern(upload, prefix: str, suffix: str = "") -> str:
+    """Speichert eine hochgeladene Datei in einer temporären Datei und gibt deren Pfad zurück"""
+    fd, pfad = tempfile.mkstemp(prefix=prefix, suffix=suffix)
+    os.close(fd)
+    upload.save(pfad)
+    return pfad
 
-                current_app.logger.warning(f"Beim Versuch von {g.lehrer}, einen Klausurplan zu importieren, "
-                                           f"ist ein Fehler aufgetreten.", exc_info=exc)
-                return redirect(url_for(".import"), code=303)
 
-    ks_file = request.files.get("koopschueler", None)
-    ks_file_given = False
+def _import_ausfuehren(auftrag: Auftrag, lehrer_name: str, plan_dateien: List[Tuple[str, str, str]],
+                       new_lehrer_password: str, vorschau: bool, ks_datei: Optional[str]):
+    """Importiert die Klausurpläne und die Koopschülerliste und löscht anschließend die hochgeladenen Dateien"""
+    with contextlib.ExitStack() as stack:
+        for pfad, _, _ in plan_dateien:
+            stack.callback(os.remove, pfad)
+        if ks_datei is not None:
+            stack.callback(os.remove, ks_datei)
+
+        _import_plaene(auftrag, lehrer_name, plan_dateien, new_lehrer_password, vorschau, ks_datei)
+
+
+def _import_plaene(auftrag: Auftrag, lehrer_name: str, plan_dateien: List[Tuple[str, str, str]],
+                   new_lehrer_password: str, vorschau: bool, ks_datei: Optional[str]):
+    anzahl_schritte = len(plan_dateien) + 2
+    auftrag.fortschritt_melden(0.0, "Klausurpläne werden eingelesen...")
+
+    stufen = {stufe.name: stufe for stufe in Stufe.query.all()}
+
+    # Pläne, deren Datei seit dem letzten Import der Stufe unverändert ist, werden nicht erneut eingelesen
+    plan_aenderungen = {}
+    zu_lesen = []
+    hashes = []
+    for plan_datei in plan_dateien:
+        pfad, _, stufe_name = plan_datei
+        hash_ = datei_hash(pfad)
+        stufe = stufen[stufe_name]
+        if stufe.import_date is not None and stufe.import_hash == hash_:
+            plan_aenderungen[stufe_name] = Planaenderungen.unveraendert(stufe)
+        else:
+            zu_lesen.append(plan_datei)
+            hashes.append(hash_)
+
+    plan_inhalte = plaene_lesen(zu_lesen)
+    new_lehrer_pwd_hash = lehrer_pwd_hash(new_lehrer_password) if zu_lesen else b""
+
+    plan_abgleiche = []
+    schueler_daten = None
+
+    for nr, ((_, _, stufe_name), hash_) in enumerate(zip(zu_lesen, hashes)):
+        stufe = stufen[stufe_name]
+
+        # Die Pläne werden zunächst nur eingelesen und abgeglichen, ohne die Datenbank zu sperren
+        try:
+            abgleich = plan_abgleichen(next(plan_inhalte), stufe, new_lehrer_pwd_hash, schueler_daten, hash_)
+            plan_abgleiche.append(abgleich)
+            schueler_daten = abgleich.schueler_daten
+        except (KeyError, ValueError, ParseError, KlausurplanImportError) as exc:
+            plan_inhalte.close()
+            db.session.rollback()
+
+            auftrag.abschliessen(f"Beim Importieren des Klausurplans für die {stufe.name} ist ein Fehler "
+                                 f"aufgetreten.\nWahrscheinlich ist die Klausurplandatei ungültig oder es gibt einen "
+                                 f"Konflikt mit den bisherigen Daten.\n\nFehlerbeschreibung: {type(exc).__name__}\n"
+                                 f"{exc}", "error")
+            db.session.commit()
+
+            current_app.logger.warning(f"Beim Versuch von {lehrer_name}, einen Klausurplan zu importieren, "
+                                       f"ist ein Fehler aufgetreten.", exc_info=exc)
+            return
+
+        auftrag.fortschritt_melden((nr + 1) / anzahl_schritte, f"Klausurplan für die {stufe.name} eingelesen...")
+
+    # Ab hier wird in die Datenbank geschrieben, daher wird bis zum Ende kein Fortschritt mehr gemeldet
+    auftrag.fortschritt_melden((anzahl_schritte - 1) / anzahl_schritte, "Änderungen werden gespeichert...")
+
+    # Alle Pläne in einem Schritt übernehmen
+    for abgleich in plan_abgleiche:
+        plan_aenderungen[abgleich.stufe.name] = abgleich.aenderungen if vorschau else abgleich.uebernehmen()
 
     # Koopschülerdatei importieren
     ks_import_failures = []
-    if ks_file and ks_file.filename:
-        ks_file_given = True
+    if ks_datei is not None:
         _del_koopschueler()
 
-        filename_ext = os.path.splitext(ks_file.filename)[1]
-        with tempfile.NamedTemporaryFile(prefix="nateman_ks_import_", suffix=filename_ext) as fp:
-            ks_file.save(fp.name)
+        try:
+            ks_import_failures = import_excel_koop(ks_datei)
+        except (InvalidFileException, KoopSchuelerImportError) as exc:
+            db.session.rollback()
 
-            try:
-                ks_import_failures = import_excel_koop(fp.name)
-            except (InvalidFileException, KoopSchuelerImportError) as exc:
-                db.session.rollback()
+            auftrag.abschliessen(f"Beim Importieren der Koopschülerliste ist ein Fehler aufgetreten.\n\n"
+                                 f"Fehlerbeschreibung: {type(exc).__name__}\n{exc}", "error")
+            db.session.commit()
 
-                flash(f"Beim Importieren der Koopschülerliste ist ein Fehler aufgetreten.\n\n"
-                      f"Fehlerbeschreibung: {type(exc).__name__}\n{exc}", "error")
+            current_app.logger.warning(f"Beim Versuch von {lehrer_name}, eine Koopschülerliste zu importieren, "
+                                       f"ist ein Fehler aufgetreten.", exc_info=exc)
+            return
 
-                current_app.logger.warning(f"Beim Versuch von {g.lehrer}, eine Koopschülerliste zu importieren, "
-                                           f"ist ein Fehler aufgetreten.", exc_info=exc)
-                return redirect(url_for(".import"), code=303)
+    aenderungen_msg = "".join(f"\n\n{plan_aenderungen[stufe_name]}" for _, _, stufe_name in plan_dateien)
 
-    if len(plan_given) == 0 and not ks_file_given:
-        flash("Es wurden keine Pläne angegeben.", "error")
+    if vorschau:
+        db.session.rollback()
+        ks_msg = ""
+        if len(ks_import_failures) != 0:
+            ks_msg = ("\n\nKoopschülerimport: Folgende SuS könnten nicht importiert werden:\n"
+                      + "; ".join(f"{failure[0]}, {failure[1]}" for failure in ks_import_failures) + ".")
+        auftrag.abschliessen("Vorschau, es wurden keine Änderungen gespeichert." + aenderungen_msg + ks_msg,
+                             "warning")
     else:
         if len(ks_import_failures) == 0:
-            flash("Pläne importiert.", "success")
+            auftrag.abschliessen("Pläne importiert." + aenderungen_msg, "success")
         else:
-            flash("Pläne importiert.\n\nKoopschülerimport: Folgende SuS konnten nicht importiert werden:\n"
-                  + "; ".join(f"{failure[0]}, {failure[1]}" for failure in ks_import_failures) + ".\n"
-                  "Die restlichen KoopSuS wurden trotzdem importiert.", "warning")
-        current_app.logger.info(f"{g.lehrer} hat Pläne importiert.")
-        db.session.commit()
+            auftrag.abschliessen("Pläne importiert." + aenderungen_msg + "\n\nKoopschülerimport: Folgende SuS "
+                                 "konnten nicht importiert werden:\n"
+                                 + "; ".join(f"{failure[0]}, {failure[1]}" for failure in ks_import_failures) + ".\n"
+                                 "Die restlichen KoopSuS wurden trotzdem importiert.", "warning")
+        current_app.logger.info(f"{lehrer_name} hat Pläne importiert.")
 
-    return redirect(url_for(".import"), code=303)
+    # Das Ergebnis des Auftrags wird zusammen mit den importierten Daten gespeichert
+    db.session.commit()
 
 
 def _del_plan(stufe: Stufe):
     """Löscht alle Klausuren und Schüler der angegebenen Stufe"""
     stufe.import_date = None
+    stufe.import_hash = None
+    stufe.import_zusammenfassung = None
     Klausur.query.filter_by(stufe=stufe).delete()
     Schueler.query.filter_by(stufe=stufe).delete()
 
@@ -23,7 +23,8 @@ from typing import Dict, List, Tuple
 from flask import Blueprint, current_app, flash, g, redirect, render_template, request, url_for
 
 from .auth import beratungslehrer_required
-from ..models import Klausurteilnahme, db, Schueler, Klausur, Stufe
+from ..models import Klausurteilnahme, db, Schueler, Klausur
+from ..stammdaten import StufeDaten
 
 bp = Blueprint("schueler", __name__, url_prefix="/schueler")
 
@@ -33,11 +34,11 @@ bp = Blueprint("schueler", __name__, url_prefix="/schueler")
 def versaeumnisse():
     """ Versäumnisliste (Seite *Versäumnisse*) """
     if request.method != "POST":
-        klausur_dict: Dict[Stufe, Tuple[List[Klausurteilnahme], List[Klausurteilnahme]]] = {}
+        klausur_dict: Dict[StufeDaten, Tuple[List[Klausurteilnahme], List[Klausurteilnahme]]] = {}
         for stufe in g.lehrer.accessible_stufen():
             base_query = Klausur.query.join(Klausurteilnahme) \
                 .filter(Klausurteilnahme.versaeumt) \
-                .filter(Klausur.stufe == stufe) \
+                .filter(Klausur.stufe_name == stufe.name) \
                 .group_by(Klausur) \
                 .order_by(Klausur.date)
 
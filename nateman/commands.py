@@ -19,12 +19,17 @@
 Enthält Befehle zur Verwendung im Terminal (Command Line Interface).
 """
 
+import json
+import os
+
 import click
+from flask import current_app
 from flask.cli import with_appcontext
+from sqlalchemy.engine import make_url
 
-from . import emails, util
+from . import assigner, benchmark, emails, migrationen, scheduler, sqlite_database_path, util
 from .config_manager import config
-from .models import Lehrer, Stufe, db, Session
+from .models import Auftrag, Lehrer, Stufe, db, Session
 
 
 @click.group()
@@ -168,8 +173,12 @@ def take_admin_command(kuerzel):
 def cleanup_command():
     """Entfernt abgelaufene Daten aus der NateMan-Datenbank."""
     Session.cleanup()
+    Auftrag.cleanup()
     Lehrer.password_reset_cleanup()
     db.session.commit()
+
+    if db.engine.dialect.name == "sqlite":
+        db.session.execute(db.text("PRAGMA optimize"))
     return 0
 
 
@@ -202,6 +211,88 @@ def apply_email_format_command(fmt, override):
     return 0
 
 
+@click.command("copy-database")
+@click.argument("source", type=click.Path(exists=True, dir_okay=False), required=False)
+@click.option("--batch-size", type=click.INT, default=1000, show_default=True)
+@click.option("--yes", is_flag=True)
+@with_appcontext
+def copy_database_command(source, batch_size, yes):
+    """Kopiert alle Daten einer SQLite-Datenbank in die konfigurierte Datenbank."""
+    source = os.path.abspath(source or sqlite_database_path(current_app))
+    source_uri = "sqlite:///" + source
+
+    if db.engine.url == make_url(source_uri):
+        click.echo("Fehler: Die Quelldatenbank ist bereits die konfigurierte Datenbank. Bitte geben Sie in der "
+                   "Konfiguration unter database.uri die Zieldatenbank an.", err=True)
+        return 1
+
+    if not yes:
+        if not click.confirm(f"Durch diesen Vorgang werden alle Daten in {db.engine.url!r} durch die Daten aus "
+                             f"{source} ersetzt. Fortfahren?"):
+            click.echo("Vorgang abgebrochen.")
+            return 0
+
+    try:
+        anzahlen = migrationen.datenbank_kopieren(
+            source_uri, batch_size, lambda tabelle, anzahl: click.echo(f"{tabelle}: {anzahl} Zeilen kopiert"))
+    except ValueError as exc:
+        click.echo(f"Fehler: {exc}", err=True)
+        return 1
+
+    click.echo(f"Die Datenbank wurde erfolgreich kopiert ({sum(anzahlen.values())} Zeilen).")
+    return 0
+
+
+@click.command("benchmark")
+@click.option("--schueler", "schueler_anzahl", type=click.INT, default=120, show_default=True)
+@click.option("--kurse-pro-schueler", type=click.INT, default=10, show_default=True)
+@click.option("--lk-anteil", type=click.FLOAT, default=0.25, show_default=True)
+@click.option("--koop-anteil", type=click.FLOAT, default=0.05, show_default=True)
+@click.option("--versaeumnisquote", type=click.FLOAT, default=0.1, show_default=True)
+@click.option("--seed", type=click.INT, default=0, show_default=True)
+@click.option("-s", "--strategie", "strategie_namen", type=click.Choice(list(scheduler.STRATEGIEN)), multiple=True)
+def benchmark_command(schueler_anzahl, kurse_pro_schueler, lk_anteil, koop_anteil, versaeumnisquote, seed,
+                      strategie_namen):
+    """Misst die Terminzuordnung für eine synthetische Stufe und gibt das Ergebnis als JSON aus."""
+    k_schueler = benchmark.synthetische_stufe(schueler_anzahl, kurse_pro_schueler, lk_anteil, koop_anteil,
+                                              versaeumnisquote, seed=seed)
+    strategien = [scheduler.STRATEGIEN[name]() for name in strategie_namen] or None
+
+    ergebnis = benchmark.zuordnung_messen(k_schueler, strategien)
+    ergebnis["parameter"] = {
+        "schueler": schueler_anzahl,
+        "kurse_pro_schueler": kurse_pro_schueler,
+        "lk_anteil": lk_anteil,
+        "koop_anteil": koop_anteil,
+        "versaeumnisquote": versaeumnisquote,
+        "seed": seed,
+    }
+
+    click.echo(json.dumps(ergebnis, indent=2))
+    return 0
+
+
+@click.command("benchmark-konfliktgraph")
+@click.option("--wiederholungen", type=click.INT, default=3, show_default=True)
+def benchmark_konfliktgraph_command(wiederholungen):
+    """Vergleicht die Erstellung des Konfliktgraphen mit und ohne NumPy und gibt das Ergebnis als JSON aus."""
+    if assigner.numpy is None:
+        click.echo("Fehler: NumPy ist nicht installiert.", err=True)
+        return 1
+
+    # ELSE
+
+    messungen, crossover = benchmark.konfliktgraph_crossover(wiederholungen=wiederholungen)
+    ergebnis = {
+        "messungen": [{"teilnahmen": anzahl, "python_sekunden": zeit_python, "numpy_sekunden": zeit_numpy}
+                      for anzahl, zeit_python, zeit_numpy in messungen],
+        "numpy_schneller_ab": crossover,
+    }
+
+    click.echo(json.dumps(ergebnis, indent=2))
+    return 0
+
+
 def init_commands():
     cli.add_command(add_lehrer_command)
     cli.add_command(make_admin_command)
@@ -211,6 +302,9 @@ def init_commands():
     cli.add_command(send_reminder_mails_command)
     cli.add_command(apply_email_format_command)
     cli.add_command(cleanup_command)
+    cli.add_command(copy_database_command)
+    cli.add_command(benchmark_command)
+    cli.add_command(benchmark_konfliktgraph_command)
 
 
 init_commands()
@@ -22,7 +22,7 @@ Enthält Funktionen für den E-Mail-Versand.
 import smtplib
 from datetime import datetime
 from email.mime.text import MIMEText
-from typing import Optional, Union
+from typing import Callable, Optional, Union
 
 from flask import current_app, render_template
 from sqlalchemy.sql.elements import and_
@@ -99,10 +99,12 @@ def send_password_reset_mail(name: str, address: str, token: str) -> None:
     _send_mail(name, address, "NateMan: Passwortzurücksetzung", content)
 
 
-def send_reminder_mails() -> int:
+def send_reminder_mails(fortschritt: Optional[Callable[[float, str], None]] = None) -> int:
     """
     Sendet Erinnerungsemails an alle Lehrer, die unbearbeitete vergangene Klausuren haben.
 
+    :param fortschritt: Funktion, die vor jedem Lehrer mit dem Anteil der bereits erledigten Arbeit und einer
+        Beschreibung des nächsten Schritts aufgerufen wird
     :return: Anzahl der E-Mails, die nicht versandt werden konnten
     """
     logger = current_app.logger
@@ -112,7 +114,11 @@ def send_reminder_mails() -> int:
     smtp = _smtp_create()
 
     fail_count = 0
-    for lehrer in Lehrer.query.all():
+    alle_lehrer = Lehrer.query.all()
+    for nr, lehrer in enumerate(alle_lehrer):
+        if fortschritt is not None:
+            fortschritt(nr / len(alle_lehrer), f"Erinnerungsemail an {lehrer.kuerzel} wird versandt...")
+
         not_edited_list = Klausur.query \
             .filter(and_(Klausur.date <= datetime.now().date(), Klausur.lehrer == lehrer, ~Klausur.edited)) \
             .order_by(Klausur.date).all()
@@ -15,91 +15,130 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from typing import Iterable, Optional
+from typing import BinaryIO, Callable, Dict, Iterable, List, NamedTuple, Optional, Union
 
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font
 
-from . import assigner
-from .models import Klausur, Klausurteilnahme, Schueler, Stufe
-
-
-def excelexport(filepath: str, stufen: Optional[Iterable[Stufe]] = None):
+from . import assigner, scheduler
+from .models import Klausur, Klausurteilnahme, Lehrer, Schueler, Stufe, Terminzuordnung, db
+
+
+class Exportzeile(NamedTuple):
+    """Die für den Export benötigten Daten einer nachzuschreibenden Klausurteilnahme"""
+    stufe_name: str
+    klausur_id: int
+    schueler_id: int
+    nachname: str
+    vorname: str
+    koop: bool
+    kursname: str
+    lehrer_kuerzel: str
+    laenge: Optional[int]
+    attestiert: bool
+    annotation: Optional[str]
+
+
+def exportzeilen_laden(stufen: Iterable[Stufe]) -> Dict[str, List[Exportzeile]]:
+    """
+    Lädt die nachzuschreibenden Klausurteilnahmen der angegebenen Stufen mit einer einzigen Abfrage,
+    die nur die benötigten Spalten liest (ohne ORM-Objekte und deren Beziehungen).
+
+    :param stufen: Stufen
+    :return: Dictionary, das Stufennamen die nach Namen sortierten Exportzeilen der Stufe zuordnet
+    """
+    stufen_namen = [s.name for s in stufen]
+    zeilen: Dict[str, List[Exportzeile]] = {name: [] for name in stufen_namen}
+
+    if not stufen_namen:
+        return zeilen
+
+    query = db.session.query(Klausur.stufe_name, Klausurteilnahme.klausur_id, Klausurteilnahme.schueler_id,
+                             Schueler.nachname, Schueler.vorname, Schueler.koop, Klausur.kursname, Lehrer.kuerzel,
+                             Klausur.laenge, Klausurteilnahme.attestiert, Klausur.annotation) \
+        .select_from(Klausurteilnahme) \
+        .join(Klausur, Klausurteilnahme.klausur_id == Klausur.id) \
+        .join(Schueler, Klausurteilnahme.schueler_id == Schueler.id) \
+        .join(Lehrer, Klausur.lehrer_id == Lehrer.id) \
+        .filter(Klausurteilnahme.versaeumt) \
+        .filter(~Klausurteilnahme.nachgeschrieben) \
+        .filter(Klausur.stufe_name.in_(stufen_namen)) \
+        .order_by(Schueler.nachname, Schueler.vorname)
+
+    for row in query:
+        zeilen[row[0]].append(Exportzeile._make(row))
+
+    return zeilen
+
+
+def excelexport(file: Union[str, BinaryIO], stufen: Optional[Iterable[Stufe]] = None,
+                fortschritt: Optional[Callable[[float, str], None]] = None):
+    """
+    Exportiert die Nachschreibpläne der angegebenen Stufen als XLSX-Datei.
+    Die Arbeitsmappe wird im Write-only-Modus zeilenweise geschrieben.
+
+    :param file: Pfad oder binäres Dateiobjekt, in das die XLSX-Datei geschrieben wird
+    :param stufen: zu exportierende Stufen (Voreinstellung: alle)
+    :param fortschritt: Funktion, die vor jeder Stufe und vor dem Speichern mit dem Anteil der bereits erledigten
+        Arbeit und einer Beschreibung des nächsten Schritts aufgerufen wird
+    """
     # Intiziert die Exceldatei
-    workbook = Workbook()
+    workbook = Workbook(write_only=True)
 
     # Holt sich alle Stufen falls keinen Angegeben sind
     if stufen is None:
         stufen = Stufe.query.all()
 
-    # exstellt für jede Stufe ein Excelsheet
-    for s in stufen:
+    stufen = list(stufen)
+
+    # Holt sich alle vNachschreiben aller Stufen aus der Datenbank
+    alle_zeilen = exportzeilen_laden(stufen)
+
+    # Die Strategie (beim Portfolio-Verfahren samt Prozesspool) wird für alle Stufen verwendet
+    strategie = scheduler.strategie_aus_config()
+
+    with strategie:
+        # exstellt für jede Stufe ein Excelsheet
+        for nr_stufe, s in enumerate(stufen):
+            if fortschritt is not None:
+                fortschritt(nr_stufe / (len(stufen) + 1), f"Nachschreibplan für die {s.name} wird erstellt...")
 
-        # Holt sich alle vNachschreiben in eine List aus der Datenbank
-        k_schueler = Klausurteilnahme.query.join(Klausur).join(Schueler).filter(Klausurteilnahme.versaeumt) \
-            .filter(~Klausurteilnahme.nachgeschrieben).filter(Klausur.stufe == s) \
-            .order_by(Schueler.nachname, Schueler.vorname).all()
+            k_schueler = alle_zeilen[s.name]
 
-        # Holt sich die Zuordnugsvoschläge
-        suggestions = assigner.zuordnen(k_schueler)
+            # Holt sich die Zuordnugsvoschläge, aus dem Cache, falls sich seit dem letzten Export nichts geändert hat
+            kurs_termine = {}
+            if len(k_schueler) != 0:
+                inhalt_hash = scheduler.inhalt_hash(k_schueler, strategie)
+                kurs_termine = Terminzuordnung.get(s, inhalt_hash)
+                if kurs_termine is None:
+                    graph = assigner.konfliktgraph_erstellen(k_schueler)
+                    kurs_termine = scheduler.kurs_termine_berechnen(k_schueler, strategie, graph)
+                    Terminzuordnung.speichern(s, inhalt_hash, kurs_termine)
+            termin_nummern = scheduler.termin_nummern(k_schueler, kurs_termine)
 
-        # Initialisiert das Excelsheet
-        workbook.create_sheet(s.name)
-        worksheet = workbook[s.name]
+            # Initialisiert das Excelsheet
+            worksheet = workbook.create_sheet(s.name)
 
-        # Fügt die Schüle in die Exceltabelle ein.
+            # Fügt die Schüle in die Exceltabelle ein.
 
-        if len(k_schueler) != 0:
+            if len(k_schueler) != 0:
+
+                worksheet.append(["Nr", "Name", "Vorname", "Kurs", "Lehrer", "Dauer [min]", "Attest",
+                                  "Termin(Vorschlag)", "Bemerkung"])
+
+                for nr, zeile in enumerate(k_schueler, start=1):
+                    worksheet.append([nr, zeile.nachname, zeile.vorname, zeile.kursname, zeile.lehrer_kuerzel,
+                                      zeile.laenge, "Ja" if zeile.attestiert else "Nein",
+                                      termin_nummern.get((zeile.klausur_id, zeile.schueler_id), "problem"),
+                                      zeile.annotation])
 
-            worksheet.cell(1, 1, "Nr")
-            worksheet.cell(1, 2, "Name")
-            worksheet.cell(1, 3, "Vorname")
-            worksheet.cell(1, 4, "Kurs")
-            worksheet.cell(1, 5, "Lehrer")
-            worksheet.cell(1, 6, "Dauer [min]")
-            worksheet.cell(1, 7, "Attest")
-            if suggestions is None:
-                worksheet.cell(1, 8, "Bemerkung")
             else:
-                worksheet.cell(1, 8, "Termin(Vorschlag)")
-                worksheet.cell(1, 9, "Bemerkung")
-
-            i = 0
-
-            while i < len(k_schueler):
-                worksheet.cell(i + 2, 1, i + 1)
-                worksheet.cell(i + 2, 2, k_schueler[i].schueler.nachname)
-                worksheet.cell(i + 2, 3, k_schueler[i].schueler.vorname)
-                worksheet.cell(i + 2, 4, k_schueler[i].klausur.kursname)
-                worksheet.cell(i + 2, 5, str(k_schueler[i].klausur.lehrer.kuerzel))
-                worksheet.cell(i + 2, 6, k_schueler[i].klausur.laenge)
-                if k_schueler[i].attestiert:
-                    worksheet.cell(i + 2, 7, "Ja")
-                else:
-                    worksheet.cell(i + 2, 7, "Nein")
-
-                nichtgefunden = True
-                if suggestions is not None:
-                    for i2 in range(0, len(suggestions)):
-                        if k_schueler[i] in suggestions[i2]:
-                            worksheet.cell(i + 2, 8, i2 + 1)
-                            nichtgefunden = False
-                    if nichtgefunden:
-                        worksheet.cell(i + 2, 8, "problem")
-                        nichtgefunden = True
-                    worksheet.cell(i + 2, 9, k_schueler[i].klausur.annotation)
-                else:
-                    worksheet.cell(i + 2, 8, k_schueler[i].klausur.annotation)
-                i += 1
-
-            del i
-            del nichtgefunden
-
-        else:
-            bold = Font(bold=True)
-            worksheet.cell(1, 1, "Keine Schüler fehlen")
-            worksheet.cell(1, 1, ).font = bold
-
-    workbook.remove(workbook["Sheet"])
-    workbook.close()
-    workbook.save(filepath)
+                zelle = WriteOnlyCell(worksheet, "Keine Schüler fehlen")
+                zelle.font = Font(bold=True)
+                worksheet.append([zelle])
+
+    if fortschritt is not None:
+        fortschritt(len(stufen) / (len(stufen) + 1), "Datei wird gespeichert...")
+
+    workbook.save(file)
@@ -18,15 +18,27 @@
 """
 Enthält Funktionen zum Import von Daten.
 """
+import contextlib
+import gzip
+import hashlib
 import io
+import itertools
+import multiprocessing
+import os
 import re
+import string
+import zipfile
+import zlib
+from array import array
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import datetime
-from typing import TextIO, SupportsInt, Union
+from typing import BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, TextIO, SupportsInt, \
+    Tuple, Union
 
 import bcrypt
 from openpyxl import load_workbook
-from sqlalchemy.sql import and_, exists
-from xml.dom import minidom
+from sqlalchemy import tuple_
+from xml.etree import ElementTree
 
 from . import util
 from .config_manager import config
@@ -51,15 +63,386 @@ def _nbit_int(x: Union[str, bytes, SupportsInt], base=10, maxbits=32):
     return result
 
 
-def import_csv(file: TextIO, stufe: Stufe, new_lehrer_pwd: str) -> None:
+def _nocase(text: str) -> str:
+    """
+    :return: ``text`` so normalisiert, wie die Datenbank ihn in Spalten mit :func:`models._nocase_string` vergleicht
+        (SQLite: nur ASCII-Buchstaben, PostgreSQL: alle Buchstaben)
+    """
+    if db.engine.dialect.name == "postgresql":
+        return text.casefold()
+    # ELSE
+    return text.translate(_NOCASE_TABELLE)
+
+
+_NOCASE_TABELLE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def _lehrer_ids() -> Dict[str, int]:
+    """
+    :return: Dictionary, das den (mit :func:`_nocase` normalisierten) Kürzeln aller registrierten Lehrer deren IDs
+        zuordnet
+    """
+    return {_nocase(lehrer_kuerzel): lehrer_id
+            for lehrer_id, lehrer_kuerzel in db.session.query(Lehrer.id, Lehrer.kuerzel)}
+
+
+def _lehrer_registrieren(kuerzel: Iterable[str], lehrer_ids: Dict[str, int], new_lehrer_pwd_hash: bytes) -> None:
+    """
+    Registriert die Lehrer mit den angegebenen Kürzeln, die noch nicht in ``lehrer_ids`` enthalten sind, und trägt
+    deren IDs in ``lehrer_ids`` ein.
+
+    :param kuerzel: Lehrerkürzel
+    :param lehrer_ids: Dictionary wie von :func:`_lehrer_ids`
+    :param new_lehrer_pwd_hash: Passwort-Hash für neu registrierte Lehrerkonten
+    """
+    neue_lehrer = {}
+    for lehrer_kuerzel in kuerzel:
+        if _nocase(lehrer_kuerzel) not in lehrer_ids and _nocase(lehrer_kuerzel) not in neue_lehrer:
+            lehrer_entity = Lehrer(kuerzel=lehrer_kuerzel, is_confirmed=True, pwd_hash=new_lehrer_pwd_hash)
+            # Falls ein E-Mailadressenformat konfiguriert ist, dieses nutzen.
+            email_address_format = config.get("email-address-format", None)
+            if email_address_format is not None:
+                lehrer_entity.set_default_email_address(email_address_format)
+
+            neue_lehrer[_nocase(lehrer_kuerzel)] = lehrer_entity
+
+    if neue_lehrer:
+        db.session.add_all(neue_lehrer.values())
+        db.session.flush()
+        lehrer_ids.update((key, lehrer_entity.id) for key, lehrer_entity in neue_lehrer.items())
+
+
+def _schueler_daten() -> Dict[int, Tuple[str, str, str]]:
+    """
+    :return: Dictionary, das den IDs aller eingetragenen Schüler deren Nachnamen, Vornamen und Stufe zuordnet
+    """
+    return {schueler_id: (nachname, vorname, stufe_name) for schueler_id, nachname, vorname, stufe_name
+            in db.session.query(Schueler.id, Schueler.nachname, Schueler.vorname, Schueler.stufe_name)}
+
+
+class Planaenderungen:
+    """Änderungen, die der Import eines Klausurplans an den Daten einer Stufe vornimmt"""
+
+    def __init__(self, stufe: Stufe):
+        self.stufe = stufe
+        self.klausuren_neu: List[str] = []
+        self.klausuren_geaendert: List[str] = []
+        self.klausuren_geloescht: List[str] = []
+        self.schueler_neu = 0
+        self.schueler_geaendert = 0
+        self.schueler_geloescht = 0
+        self.teilnahmen_neu = 0
+        self.teilnahmen_geloescht = 0
+        self.datei_unveraendert = False
+
+    @staticmethod
+    def unveraendert(stufe: Stufe) -> "Planaenderungen":
+        """
+        :return: Änderungen für einen Plan, der nicht erneut importiert wurde, da die Datei seit dem letzten Import
+            unverändert ist (siehe :func:`datei_hash`)
+        """
+        aenderungen = Planaenderungen(stufe)
+        aenderungen.datei_unveraendert = True
+        return aenderungen
+
+    def __bool__(self):
+        return bool(self.klausuren_neu or self.klausuren_geaendert or self.klausuren_geloescht or self.schueler_neu
+                    or self.schueler_geaendert or self.schueler_geloescht or self.teilnahmen_neu
+                    or self.teilnahmen_geloescht)
+
+    def __str__(self):
+        if self.datei_unveraendert:
+            return (f"{self.stufe.name}: Datei unverändert seit dem Import am "
+                    f"{self.stufe.import_date.strftime('%d.%m.%Y')}, nicht erneut importiert")
+        # ELSE
+        if not self:
+            return f"{self.stufe.name}: keine Änderungen"
+        # ELSE
+        klausuren = ", ".join(f"{len(kursnamen)} {beschreibung}" + (f" ({', '.join(kursnamen)})" if kursnamen else "")
+                              for beschreibung, kursnamen in (("neu", self.klausuren_neu),
+                                                              ("geändert", self.klausuren_geaendert),
+                                                              ("gelöscht", self.klausuren_geloescht)))
+        return (f"{self.stufe.name}:\n"
+                f"Klausuren: {klausuren}\n"
+                f"Schüler: {self.schueler_neu} neu, {self.schueler_geaendert} geändert, "
+                f"{self.schueler_geloescht} gelöscht\n"
+                f"Klausurteilnahmen: {self.teilnahmen_neu} neu, {self.teilnahmen_geloescht} gelöscht")
+
+
+def _in_bloecken(werte: List, groesse: int = 500) -> Iterable[List]:
+    """Teilt ``werte`` für ``IN``-Abfragen in Blöcke auf, damit SQLite nicht zu viele Parameter erhält."""
+    for i in range(0, len(werte), groesse):
+        yield werte[i:i + groesse]
+
+
+class Planabgleich:
+    """
+    Gleicht die eingelesenen Daten eines Klausurplans mit den bestehenden Daten einer Stufe ab.
+
+    Klausuren werden anhand von Kursname und Datum, Schüler anhand ihrer ID zugeordnet. Beim Einlesen wird die
+    Datenbank nur gelesen; alle Änderungen werden vorgemerkt und erst durch :meth:`uebernehmen` in einem Schritt
+    geschrieben, damit die Datenbank nur kurz gesperrt ist. Unveränderte Klausurteilnahmen bleiben dabei mit ihren
+    Einträgen (versäumt, attestiert, ...) erhalten. Manuell hinzugefügte Schüler (negative IDs), die im Plan nicht
+    vorkommen, bleiben ebenfalls erhalten.
+    """
+
+    def __init__(self, stufe: Stufe, new_lehrer_pwd_hash: bytes,
+                 schueler_daten: Optional[Dict[int, Tuple[str, str, str]]] = None):
+        """
+        :param stufe: Stufe, für die der Plan importiert werden soll
+        :param new_lehrer_pwd_hash: Passwort-Hash für neu registrierte Lehrerkonten
+        :param schueler_daten: :attr:`schueler_daten` eines zuvor eingelesenen, noch nicht übernommenen Plans einer
+            anderen Stufe, damit Schüler nicht in zwei Stufen gleichzeitig eingetragen werden
+        """
+        self.stufe = stufe
+        self.aenderungen = Planaenderungen(stufe)
+        self._new_lehrer_pwd_hash = new_lehrer_pwd_hash
+        self._lehrer_ids = _lehrer_ids()
+
+        # Alle eingetragenen Schüler: ID -> (Nachname, Vorname, Stufe); wird beim Einlesen um neue Schüler ergänzt
+        self.schueler_daten = _schueler_daten() if schueler_daten is None else schueler_daten
+        self._bestehende_schueler = {schueler_id for schueler_id, daten in self.schueler_daten.items()
+                                     if daten[2] == stufe.name}
+
+        # Koopschüler ohne vollständige Angaben (Vorname "???") aus dem letzten Import, nach Nachnamen
+        self._koop_schueler_ids: Dict[str, List[int]] = {}
+        for schueler_id in sorted(self._bestehende_schueler, reverse=True):
+            nachname, vorname, _ = self.schueler_daten[schueler_id]
+            if schueler_id < 0 and vorname == "???":
+                self._koop_schueler_ids.setdefault(nachname, []).append(schueler_id)
+
+        # Bestehende Klausuren: (mit _nocase normalisierter Kursname, Datum) -> (ID, Von, Bis, Lehrer-ID, Kursname)
+        self._klausuren = {(_nocase(kursname), date): (klausur_id, startperiod, endperiod, lehrer_id, kursname)
+                           for klausur_id, kursname, date, startperiod, endperiod, lehrer_id
+                           in db.session.query(Klausur.id, Klausur.kursname, Klausur.date, Klausur.startperiod,
+                                               Klausur.endperiod, Klausur.lehrer_id).filter_by(stufe_name=stufe.name)}
+
+        # Bestehende Klausurteilnahmen: Klausur-ID -> Schüler-IDs
+        self._teilnahmen: Dict[int, Set[int]] = {}
+        for klausur_id, schueler_id in db.session.query(Klausurteilnahme.klausur_id, Klausurteilnahme.schueler_id) \
+                .join(Klausur, Klausurteilnahme.klausur_id == Klausur.id).filter(Klausur.stufe_name == stufe.name):
+            self._teilnahmen.setdefault(klausur_id, set()).add(schueler_id)
+
+        self._plan_klausuren: Set[Tuple] = set()
+        self._plan_schueler: Set[int] = set()
+        self._entfernte_teilnahmen: List[Tuple[int, int]] = []
+
+        # Vorgemerkte Änderungen
+        self._neue_lehrer: Dict[str, str] = {}
+        self._neue_klausuren: List[Dict] = []
+        self._geaenderte_klausuren: List[Dict] = []
+        self._neue_schueler: List[Dict] = []
+        self._geaenderte_schueler: List[Dict] = []
+        self._neue_teilnahmen: List[Tuple[Dict, int]] = []
+        self._geloeschte_klausuren: List[int] = []
+        self._geloeschte_schueler: List[int] = []
+
+        # Hash der importierten Datei und Zusammenfassung des Plans, die mit dem Plan gespeichert werden
+        self.datei_hash: Optional[str] = None
+        self.zusammenfassung: Optional[str] = None
+
+    def koop_schueler_id(self, nachname: str) -> int:
+        """
+        :return: ID für einen Koopschüler ohne vollständige Angaben; bereits eingetragene Koopschüler mit demselben
+            Nachnamen werden dabei der Reihe nach wiederverwendet
+        """
+        schueler_ids = self._koop_schueler_ids.get(nachname)
+        if schueler_ids:
+            return schueler_ids.pop(0)
+        # ELSE
+        schueler_id = get_next_new_schueler_id()
+        self.schueler_daten[schueler_id] = (nachname, "???", self.stufe.name)
+        return schueler_id
+
+    def hinzufuegen(self, klausuren: List[Dict], schueler: Dict[int, Dict], teilnahmen: List[Tuple[int, int]]) -> None:
+        """
+        Gleicht einen Teil des eingelesenen Plans ab und merkt die nötigen Änderungen vor.
+
+        :param klausuren: Spaltenwerte der Klausuren, wobei das Lehrerkürzel unter ``lehrer_kuerzel`` anstelle der
+            Lehrer-ID angegeben ist
+        :param schueler: Spaltenwerte der im Plan vorkommenden Schüler nach ID
+        :param teilnahmen: Klausurteilnahmen als Tupel aus dem Index der Klausur in ``klausuren`` und der Schüler-ID
+        """
+        # Klausuren
+        for klausur in klausuren:
+            lehrer_key = _nocase(klausur["lehrer_kuerzel"])
+            if lehrer_key not in self._lehrer_ids and lehrer_key not in self._neue_lehrer:
+                self._neue_lehrer[lehrer_key] = klausur["lehrer_kuerzel"]
+
+            # Wie in der Datenbank wird der Kursname ohne Berücksichtigung der Groß-/Kleinschreibung verglichen
+            key = (_nocase(klausur["kursname"]), klausur["date"])
+            if key in self._plan_klausuren:
+                raise KlausurplanImportError(f"Zu importierender Plan für die {self.stufe.name} enthält die Klausur "
+                                             f"{klausur['kursname']} am {klausur['date'].strftime('%d.%m.%Y')} "
+                                             f"mehrfach.")
+            self._plan_klausuren.add(key)
+
+            bestehend = self._klausuren.get(key)
+            if bestehend is None:
+                self._neue_klausuren.append(klausur)
+                self.aenderungen.klausuren_neu.append(klausur["kursname"])
+            else:
+                klausur["id"] = bestehend[0]
+                if bestehend[1:] != (klausur["startperiod"], klausur["endperiod"], self._lehrer_ids.get(lehrer_key),
+                                     klausur["kursname"]):
+                    self._geaenderte_klausuren.append(klausur)
+                    self.aenderungen.klausuren_geaendert.append(klausur["kursname"])
+
+        # Schüler
+        for schueler_id, werte in schueler.items():
+            if schueler_id in self._plan_schueler:
+                continue
+            self._plan_schueler.add(schueler_id)
+
+            if schueler_id not in self._bestehende_schueler:
+                self._neue_schueler.append(werte)
+                self.aenderungen.schueler_neu += 1
+            elif self.schueler_daten[schueler_id][:2] != (werte["nachname"], werte["vorname"]):
+                self._geaenderte_schueler.append(werte)
+                self.aenderungen.schueler_geaendert += 1
+
+        # Klausurteilnahmen
+        plan_teilnahmen: List[Set[int]] = [set() for _ in klausuren]
+        for klausur_index, schueler_id in teilnahmen:
+            plan_teilnahmen[klausur_index].add(schueler_id)
+
+        for klausur, schueler_ids in zip(klausuren, plan_teilnahmen):
+            bestehende_ids = self._teilnahmen.get(klausur.get("id"), set())
+            self._neue_teilnahmen.extend((klausur, schueler_id) for schueler_id in schueler_ids - bestehende_ids)
+            self._entfernte_teilnahmen.extend((klausur["id"], schueler_id)
+                                              for schueler_id in bestehende_ids - schueler_ids)
+        self.aenderungen.teilnahmen_neu = len(self._neue_teilnahmen)
+
+    def abschliessen(self) -> "Planabgleich":
+        """
+        Merkt nach dem Einlesen des ganzen Plans das Löschen aller Klausuren, Schüler und Klausurteilnahmen der Stufe
+        vor, die im Plan nicht mehr vorkommen.
+
+        :return: dieser Abgleich
+        """
+        for key, bestehend in self._klausuren.items():
+            if key not in self._plan_klausuren:
+                self._geloeschte_klausuren.append(bestehend[0])
+                self.aenderungen.klausuren_geloescht.append(bestehend[4])
+
+        # Aus früheren Plänen importierte Schüler: positive IDs und nicht wiederverwendete Koopschüler
+        self._geloeschte_schueler = [schueler_id for schueler_id in self._bestehende_schueler
+                                     if schueler_id not in self._plan_schueler and schueler_id > 0]
+        for schueler_ids in self._koop_schueler_ids.values():
+            self._geloeschte_schueler.extend(schueler_ids)
+        self.aenderungen.schueler_geloescht = len(self._geloeschte_schueler)
+
+        # Teilnahmen von Schülern, die nicht aus dem Plan stammen, bleiben erhalten
+        geloeschte_klausuren = set(self._geloeschte_klausuren)
+        geloeschte_schueler = set(self._geloeschte_schueler)
+        self._entfernte_teilnahmen = [(klausur_id, schueler_id)
+                                      for klausur_id, schueler_id in self._entfernte_teilnahmen
+                                      if (schueler_id in self._plan_schueler or schueler_id > 0)
+                                      and schueler_id not in geloeschte_schueler]
+
+        self.aenderungen.teilnahmen_geloescht = len(self._entfernte_teilnahmen) + sum(
+            1 for klausur_id, schueler_ids in self._teilnahmen.items() for schueler_id in schueler_ids
+            if klausur_id in geloeschte_klausuren or schueler_id in geloeschte_schueler)
+
+        return self
+
+    def uebernehmen(self) -> Planaenderungen:
+        """
+        Schreibt alle vorgemerkten Änderungen gesammelt in die Datenbank und registriert dabei noch nicht registrierte
+        Lehrer.
+
+        :return: Änderungen durch den Import
+        """
+        if self._neue_lehrer:
+            # Zwischenzeitlich (z.B. mit dem Plan einer anderen Stufe) registrierte Lehrer berücksichtigen
+            self._lehrer_ids = _lehrer_ids()
+            _lehrer_registrieren(self._neue_lehrer.values(), self._lehrer_ids, self._new_lehrer_pwd_hash)
+        for klausur in itertools.chain(self._neue_klausuren, self._geaenderte_klausuren):
+            klausur["lehrer_id"] = self._lehrer_ids[_nocase(klausur.pop("lehrer_kuerzel"))]
+
+        db.session.bulk_insert_mappings(Klausur, self._neue_klausuren, return_defaults=True)
+        db.session.bulk_update_mappings(Klausur, self._geaenderte_klausuren)
+
+        db.session.bulk_insert_mappings(Schueler, self._neue_schueler)
+        db.session.bulk_update_mappings(Schueler, self._geaenderte_schueler)
+
+        db.session.bulk_insert_mappings(Klausurteilnahme, [{"klausur_id": klausur["id"], "schueler_id": schueler_id}
+                                                           for klausur, schueler_id in self._neue_teilnahmen])
+
+        for block in _in_bloecken(self._geloeschte_klausuren):
+            Klausur.query.filter(Klausur.id.in_(block)).delete(synchronize_session=False)
+        for block in _in_bloecken(self._geloeschte_schueler):
+            Schueler.query.filter(Schueler.id.in_(block)).delete(synchronize_session=False)
+        for block in _in_bloecken(self._entfernte_teilnahmen):
+            Klausurteilnahme.query.filter(tuple_(Klausurteilnahme.klausur_id, Klausurteilnahme.schueler_id)
+                                          .in_(block)).delete(synchronize_session=False)
+
+        # Importdatum setzen
+        self.stufe.import_date = datetime.now().date()
+        self.stufe.import_hash = self.datei_hash
+        self.stufe.import_zusammenfassung = self.zusammenfassung
+
+        return self.aenderungen
+
+
+class Planinhalt(NamedTuple):
+    """
+    Ohne Datenbankzugriff eingelesener Klausurplan, der zwischen Prozessen übertragen werden kann (siehe
+    :func:`plaene_lesen`). Die Zuordnung der Schüler-IDs und der Abgleich erfolgen erst mit :func:`plan_abgleichen`.
+    """
+
+    kurs42: bool
+    """ Stammt der Plan aus einem Kurs42-Export (sonst aus einer CSV-Datei)? """
+    klausuren: List[Dict]
+    """ Spaltenwerte der Klausuren wie bei :meth:`Planabgleich.hinzufuegen` """
+    schueler: List[Tuple]
+    """
+    Angaben der Schüler in der Reihenfolge ihres ersten Vorkommens: bei CSV-Plänen (Nachname, Vorname, Geburtsdatum,
+    Zeile) bzw. (Nachname, ``None``, ``None``, Zeile) für Koopschüler ohne vollständige Angaben, bei Kurs42-Plänen
+    (DbIdnr, Nachname, Vorname)
+    """
+    teilnahmen_klausuren: array
+    """ Index der Klausur je Klausurteilnahme (als ``array``, da sich dieses schnell übertragen lässt) """
+    teilnahmen_schueler: array
+    """ Index des Schülers je Klausurteilnahme """
+
+
+def import_csv(file: TextIO, stufe: Stufe, new_lehrer_pwd: str) -> Planaenderungen:
     """
     Importiert eine Klausurliste aus der gegebenen CSV-Klausurplandatei für die angegebene Stufe.
     Registriert noch nicht registrierte Lehrer mit dem angegebenen Passwort.
-    von Niklas Elsbrock
 
-    :param file: zu importierende XML-Datei
+    :param file: zu importierende CSV-Datei
     :param stufe: Stufe, für die der Plan importiert werden soll
     :param new_lehrer_pwd: Passwort für neu registrierte Lehrerkonten
+    :return: Änderungen durch den Import
+    """
+    return csv_einlesen(file, stufe, new_lehrer_pwd).uebernehmen()
+
+
+def csv_einlesen(file: TextIO, stufe: Stufe, new_lehrer_pwd: str,
+                 schueler_daten: Optional[Dict[int, Tuple[str, str, str]]] = None) -> Planabgleich:
+    """
+    Liest eine Klausurliste aus der gegebenen CSV-Klausurplandatei für die angegebene Stufe ein und gleicht sie mit
+    den bestehenden Daten der Stufe ab, ohne etwas in die Datenbank zu schreiben.
+
+    :param file: zu importierende CSV-Datei
+    :param stufe: Stufe, für die der Plan importiert werden soll
+    :param new_lehrer_pwd: Passwort für neu registrierte Lehrerkonten
+    :param schueler_daten: siehe :class:`Planabgleich`
+    :return: Abgleich mit den vorgemerkten Änderungen (siehe :meth:`Planabgleich.uebernehmen`)
+    """
+    return plan_abgleichen(csv_lesen(file, stufe.name), stufe, lehrer_pwd_hash(new_lehrer_pwd), schueler_daten)
+
+
+def csv_lesen(file: BinaryIO, stufe_name: str) -> Planinhalt:
+    """
+    Liest eine Klausurliste aus der gegebenen CSV-Klausurplandatei ohne Datenbankzugriff ein und überprüft sie.
+    von Niklas Elsbrock
+
+    :param file: zu importierende CSV-Datei
+    :param stufe_name: Name der Stufe, für die der Plan importiert werden soll
+    :return: eingelesener Plan
     """
     col_kursname = 0
     col_lehrer_kuerzel = 1
@@ -72,18 +455,22 @@ def import_csv(file: TextIO, stufe: Stufe, new_lehrer_pwd: str) -> None:
 
     delim_regex = r"[,;]"
 
-    assert util.validate_bcrypt_password(new_lehrer_pwd)
-
-    # Importdatum setzen
-    stufe.import_date = datetime.now().date()
+    # Die Datei wird zeilenweise gelesen, damit z.B. beim Entpacken nie die ganze Datei im Speicher liegt
+    lines = io.TextIOWrapper(file)
+    next(lines, None)
 
-    new_lehrer_pwd_hash = bcrypt.hashpw(new_lehrer_pwd.encode("utf-8"), bcrypt.gensalt())
+    klausuren = []
+    schueler = []
+    teilnahmen_klausuren = array("l")
+    teilnahmen_schueler = array("l")
 
-    rows = [tuple(re.split(delim_regex, row)) for row in io.TextIOWrapper(file).read().splitlines()]
+    # (Nachname, Vorname, Geburtsdatum) -> Index in schueler
+    schueler_indizes: Dict[Tuple[str, str, int], int] = {}
 
-    for rownum, row in enumerate(rows[1:], start=2):
+    for rownum, line in enumerate(lines, start=2):
+        row = tuple(re.split(delim_regex, line.rstrip("\n")))
         if len(row) != row_len:
-            raise KlausurplanImportError(f"Zu importierender Plan für die Stufe {stufe.name} enthält in Zeile {rownum} "
+            raise KlausurplanImportError(f"Zu importierender Plan für die Stufe {stufe_name} enthält in Zeile {rownum} "
                                          f"nur {len(row)} statt der erwarteten {row_len} Werte.")
 
         kursname = row[col_kursname]
@@ -93,224 +480,436 @@ def import_csv(file: TextIO, stufe: Stufe, new_lehrer_pwd: str) -> None:
         endperiod = _nbit_int(row[col_endperiod])
 
         if startperiod < 0 or startperiod > endperiod:
-            raise KlausurplanImportError(f"Zu importierender Plan für die Stufe {stufe.name} enthält ungültigen "
+            raise KlausurplanImportError(f"Zu importierender Plan für die Stufe {stufe_name} enthält ungültigen "
                                          f"Zeitraum (Zeile: {rownum}; VonStd: {startperiod} BisStd: {endperiod})")
 
-        # eventuell bereits registrierten Lehrer bekommen
-        kurs_lehrer_entity = Lehrer.query.filter_by(kuerzel=lehrer_kuerzel).first()
-
-        # Falls der Lehrer noch nicht registriert ist, registrieren
-        if kurs_lehrer_entity is None:
-            kurs_lehrer_entity = Lehrer(kuerzel=lehrer_kuerzel, is_confirmed=True, pwd_hash=new_lehrer_pwd_hash)
-            # Falls ein E-Mailadressenformat konfiguriert ist, dieses nutzen.
-            email_address_format = config.get("email-address-format", None)
-            if email_address_format is not None:
-                kurs_lehrer_entity.set_default_email_address(email_address_format)
-
-            db.session.add(kurs_lehrer_entity)
-
-        klausur_entity = Klausur(kursname=kursname, date=date, startperiod=startperiod, endperiod=endperiod,
-                                 stufe=stufe, lehrer=kurs_lehrer_entity)
-        db.session.add(klausur_entity)
+        klausuren.append({"kursname": kursname, "lehrer_kuerzel": lehrer_kuerzel, "date": date,
+                          "startperiod": startperiod, "endperiod": endperiod, "stufe_name": stufe_name})
+        klausur_index = len(klausuren) - 1
+        klausur_schueler_indizes = set()
 
         for schueler_entry in row[col_teilnehmer].split('~'):
             schueler_data = schueler_entry.rsplit('_', maxsplit=2)
 
             if len(schueler_data) != 3:
-                schueler_entity = Schueler(id=get_next_new_schueler_id(), nachname=schueler_entry, vorname="???",
-                                           stufe=stufe, koop=True)
+                # Koopschüler ohne vollständige Angaben bekommen bei jedem Vorkommen eine eigene ID
+                schueler_index = len(schueler)
+                schueler.append((schueler_entry, None, None, rownum))
             else:
                 (nachname, vorname, birthdate) = schueler_data
-                birthdate = int(birthdate)
-                for rownum in range(100):
-                    test_id = birthdate * 100 + rownum
-                    test_schueler = Schueler.query.filter_by(id=test_id).first()
-                    if test_schueler is None:
-                        schueler_entity = Schueler(id=test_id, nachname=nachname, vorname=vorname, stufe=stufe)
-                        break
-                    elif test_schueler.nachname == nachname and test_schueler.vorname == vorname:
-                        # Ist dieser Schüler bereits für eine andere Stufe eingetragen? -> Fehler
-                        if test_schueler.stufe != stufe:
-                            raise KlausurplanImportError(f"Zu importierender Plan für die {stufe.name} enthält Schüler "
-                                                         f"({vorname} {nachname}, {birthdate}), der bereits für die "
-                                                         f"{test_schueler.stufe.name} eingetragen ist "
-                                                         f"(Zeile: {rownum}).")
-                        schueler_entity = test_schueler
-                        break
-                else:
-                    raise KlausurplanImportError(f"Zu importierender Plan für Stufe {stufe.name} enthält Schüler "
-                                                 f"({vorname} {nachname}, {birthdate}; Zeile: {rownum}), dem keine ID "
-                                                 f"gegeben werden konnte.")
-
-            # Ist derselbe Schüler bereits in dieser Klausur? -> Fehler
-            if db.session.query(exists().where(and_(Klausurteilnahme.schueler == schueler_entity,
-                                                    Klausurteilnahme.klausur == klausur_entity))).scalar():
-                raise KlausurplanImportError(f"Zu importierender Plan für die {stufe.name} enthält selben "
-                                             f"Schüler ({schueler_entity.vorname} {schueler_entity.nachname}, "
-                                             f"{schueler_entity.birthdate}, Zeile: {rownum}) mehrfach in derselben "
-                                             f"Klausur ({kursname}).")
+                key = (nachname, vorname, int(birthdate))
+                schueler_index = schueler_indizes.get(key)
+                if schueler_index is None:
+                    schueler_index = schueler_indizes[key] = len(schueler)
+                    schueler.append(key + (rownum,))
+
+                # Ist derselbe Schüler bereits in dieser Klausur? -> Fehler
+                if schueler_index in klausur_schueler_indizes:
+                    raise KlausurplanImportError(f"Zu importierender Plan für die {stufe_name} enthält selben "
+                                                 f"Schüler ({vorname} {nachname}, Zeile: {rownum}) mehrfach in "
+                                                 f"derselben Klausur ({kursname}).")
+                klausur_schueler_indizes.add(schueler_index)
 
             # Schüler zur Klausur hinzufügen
-            klausurteilnahme = Klausurteilnahme(klausur=klausur_entity, schueler=schueler_entity)
-            db.session.add(klausurteilnahme)
+            teilnahmen_klausuren.append(klausur_index)
+            teilnahmen_schueler.append(schueler_index)
 
+    return Planinhalt(False, klausuren, schueler, teilnahmen_klausuren, teilnahmen_schueler)
 
-def import_kurs42(xml_file: TextIO, stufe: Stufe, new_lehrer_pwd: str) -> None:
+
+def import_kurs42(xml_file: TextIO, stufe: Stufe, new_lehrer_pwd: str) -> Planaenderungen:
     """
     Importiert eine Klausurliste aus dem gegebenen XML-Klausurexport für die angegebene Stufe.
     Registriert noch nicht registrierte Lehrer mit dem angegebenen Passwort.
-    von Niklas Elsbrock
 
     :param xml_file: zu importierende XML-Datei
-    :param stufe: Stufe, für die die
+    :param stufe: Stufe, für die der Plan importiert werden soll
     :param new_lehrer_pwd: Passwort für neu registrierte Lehrerkonten
+    :return: Änderungen durch den Import
     """
-    assert util.validate_bcrypt_password(new_lehrer_pwd)
+    return kurs42_einlesen(xml_file, stufe, new_lehrer_pwd).uebernehmen()
+
+
+def kurs42_einlesen(xml_file: TextIO, stufe: Stufe, new_lehrer_pwd: str,
+                    schueler_daten: Optional[Dict[int, Tuple[str, str, str]]] = None) -> Planabgleich:
+    """
+    Liest eine Klausurliste aus dem gegebenen XML-Klausurexport für die angegebene Stufe ein und gleicht sie mit den
+    bestehenden Daten der Stufe ab, ohne etwas in die Datenbank zu schreiben.
+
+    :param xml_file: zu importierende XML-Datei
+    :param stufe: Stufe, für die der Plan importiert werden soll
+    :param new_lehrer_pwd: Passwort für neu registrierte Lehrerkonten
+    :param schueler_daten: siehe :class:`Planabgleich`
+    :return: Abgleich mit den vorgemerkten Änderungen (siehe :meth:`Planabgleich.uebernehmen`)
+    """
+    return plan_abgleichen(kurs42_lesen(xml_file, stufe.name), stufe, lehrer_pwd_hash(new_lehrer_pwd),
+                           schueler_daten)
+
+
+def kurs42_lesen(xml_file: BinaryIO, stufe_name: str) -> Planinhalt:
+    """
+    Liest eine Klausurliste aus dem gegebenen XML-Klausurexport ohne Datenbankzugriff ein und überprüft sie.
+
+    Die Datei wird mit ``iterparse`` schienenweise gelesen, sodass nie das ganze Dokument im Speicher liegt.
+    von Niklas Elsbrock
+
+    :param xml_file: zu importierende XML-Datei
+    :param stufe_name: Name der Stufe, für die der Plan importiert werden soll
+    :return: eingelesener Plan
+    """
+    klausuren = []
+    schueler = []
+    teilnahmen_klausuren = array("l")
+    teilnahmen_schueler = array("l")
 
-    # Importdatum setzen
-    stufe.import_date = datetime.now().date()
+    # DbIdnr -> Index in schueler
+    schueler_indizes: Dict[int, int] = {}
 
-    new_lehrer_pwd_hash = bcrypt.hashpw(new_lehrer_pwd.encode("utf-8"), bcrypt.gensalt())
+    daten = set()
 
-    xmldoc = minidom.parse(xml_file)
+    # Geöffnete Elemente vom Wurzelelement bis zum aktuellen Element, damit verarbeitete Schienen auch dann aus ihrem
+    # Elternelement entfernt werden können, wenn sie nicht direkt unter dem Wurzelelement stehen
+    pfad: List[ElementTree.Element] = []
 
     # Klausurschienen durchgehen
-    for termin in xmldoc.getElementsByTagName("KLAUSURSCHIENE"):
+    for event, termin in ElementTree.iterparse(xml_file, events=("start", "end")):
+        if event == "start":
+            pfad.append(termin)
+            continue
+
+        # ELSE
+        pfad.pop()
+        if termin.tag != "KLAUSURSCHIENE":
+            continue
 
-        date = datetime.strptime(termin.attributes["Datum"].value, "%d.%m.%Y").date()
-        startperiod = _nbit_int(termin.attributes["VonStd"].value)
-        endperiod = _nbit_int(termin.attributes["BisStd"].value)
+        date = datetime.strptime(termin.attrib["Datum"], "%d.%m.%Y").date()
+        startperiod = _nbit_int(termin.attrib["VonStd"])
+        endperiod = _nbit_int(termin.attrib["BisStd"])
 
         if startperiod < 0 or startperiod > endperiod:
-            raise KlausurplanImportError(f"Zu importierender Plan für die Stufe {stufe.name} enthält ungültigen "
-                                         f"Zeitraum (Termin: {termin.attributes['Datum'].value}; VonStd: {startperiod} "
+            raise KlausurplanImportError(f"Zu importierender Plan für die Stufe {stufe_name} enthält ungültigen "
+                                         f"Zeitraum (Termin: {termin.attrib['Datum']}; VonStd: {startperiod} "
                                          f"BisStd: {endperiod})")
 
-        if db.session.query(exists().where(and_(Klausur.date == date, Klausur.stufe == stufe))).scalar():
-            raise KlausurplanImportError(f"Zu importierender Plan für die {stufe.name} enthält zwei Klausurtermine "
+        if date in daten:
+            raise KlausurplanImportError(f"Zu importierender Plan für die {stufe_name} enthält zwei Klausurtermine "
                                          f"(Klausurschienen) für dasselbe Datum.")
 
         # Kurse dieser Schiene durchgehen
-        for kurs in termin.getElementsByTagName("KURS"):
-            kursname = kurs.attributes["Bez"].value
-            kurs_lehrerkuerzel = kurs.attributes["Lehrer"].value
+        for kurs in termin.iter("KURS"):
+            kursname = kurs.attrib["Bez"]
 
-            # eventuell bereits registrierten Lehrer bekommen
-            kurs_lehrer_entity = Lehrer.query.filter_by(kuerzel=kurs_lehrerkuerzel).first()
+            klausuren.append({"kursname": kursname, "lehrer_kuerzel": kurs.attrib["Lehrer"], "date": date,
+                              "startperiod": startperiod, "endperiod": endperiod, "stufe_name": stufe_name})
+            klausur_index = len(klausuren) - 1
+            klausur_schueler_ids = set()
 
-            # Falls der Lehrer noch nicht registriert ist, registrieren
-            if kurs_lehrer_entity is None:
-                kurs_lehrer_entity = Lehrer(kuerzel=kurs_lehrerkuerzel, is_confirmed=True, pwd_hash=new_lehrer_pwd_hash)
-                # Falls ein E-Mailadressenformat konfiguriert ist, dieses nutzen.
-                email_address_format = config.get("email-address-format", None)
-                if email_address_format is not None:
-                    kurs_lehrer_entity.set_default_email_address(email_address_format)
+            # Schüler dieses Kurses durchgehen
+            for schueler_element in kurs.iter("SCHUELER"):
+                schueler_dbid = _nbit_int(schueler_element.attrib["DbIdnr"])
 
-                db.session.add(kurs_lehrer_entity)
+                schueler_nachname = schueler_element.attrib["Name"].strip()
+                schueler_vorname = schueler_element.attrib["Vorname"].strip()
 
-            klausur_entity = Klausur(kursname=kursname, date=date, startperiod=startperiod, endperiod=endperiod,
-                                     stufe=stufe, lehrer=kurs_lehrer_entity)
-            db.session.add(klausur_entity)
+                schueler_index = schueler_indizes.get(schueler_dbid)
+                if schueler_index is None:
+                    schueler_index = schueler_indizes[schueler_dbid] = len(schueler)
+                    schueler.append((schueler_dbid, schueler_nachname, schueler_vorname))
 
-            # Schüler dieses Kurses durchgehen
-            for schueler in kurs.getElementsByTagName("SCHUELER"):
-                schueler_dbid = _nbit_int(schueler.attributes["DbIdnr"].value)
+                # Ist derselbe Schüler bereits in dieser Klausur? -> Fehler
+                if schueler_dbid in klausur_schueler_ids:
+                    raise KlausurplanImportError(f"Zu importierender Plan für die {stufe_name} enthält selben "
+                                                 f"Schüler ({schueler_vorname} {schueler_nachname}, "
+                                                 f"DbIdNr: {schueler_dbid}) mehrfach in "
+                                                 f"derselben Klausur ({kursname}).")
 
-                schueler_nachname = schueler.attributes["Name"].value.strip()
-                schueler_vorname = schueler.attributes["Vorname"].value.strip()
+                # Falls der Schüler die Klausur mitschreibt, zur Klausur hinzufügen
+                if schueler_element.attrib["Klausurschreiber"] == "j":
+                    klausur_schueler_ids.add(schueler_dbid)
+                    teilnahmen_klausuren.append(klausur_index)
+                    teilnahmen_schueler.append(schueler_index)
+
+            daten.add(date)
+
+        # Verarbeitete Schiene freigeben
+        termin.clear()
+        if pfad:
+            pfad[-1].remove(termin)
 
-                # eventuell bereits eingetragenen Schüler bekommen
-                schueler_entity = Schueler.query.filter_by(id=schueler_dbid).first()
+    return Planinhalt(True, klausuren, schueler, teilnahmen_klausuren, teilnahmen_schueler)
 
-                # Falls der Schüler noch nicht eingetragen ist, eintragen
-                if schueler_entity is None:
-                    schueler_entity = Schueler(id=schueler_dbid, nachname=schueler_nachname,
-                                               vorname=schueler_vorname, stufe=stufe)
-                    db.session.add(schueler_entity)
 
+def plan_lesen(pfad: str, dateiname: str, stufe_name: str) -> Planinhalt:
+    """
+    Liest einen Klausurplan ohne Datenbankzugriff ein; Kurs42-Exporte werden an der Dateiendung ``.xml`` erkannt,
+    alle anderen Dateien als CSV-Dateien gelesen.
+
+    Mit gzip (``.gz``) oder als ZIP-Archiv (``.zip``) mit genau einer Datei komprimierte Pläne werden beim Lesen
+    entpackt, ohne dass die entpackte Datei gespeichert wird oder ganz im Speicher liegt.
+
+    :param pfad: Pfad der zu importierenden Datei
+    :param dateiname: ursprünglicher Dateiname
+    :param stufe_name: Name der Stufe, für die der Plan importiert werden soll
+    :return: eingelesener Plan
+    """
+    with open(pfad, "rb") as file:
+        if not dateiname.endswith((".gz", ".zip")):
+            return _plan_lesen(file, dateiname, stufe_name)
+
+        # ELSE
+        try:
+            with contextlib.ExitStack() as stack:
+                if dateiname.endswith(".gz"):
+                    entpackt = stack.enter_context(gzip.GzipFile(fileobj=file, mode="rb"))
+                    entpackt_name = dateiname[:-3]
                 else:
-                    # Ist dieser Schüler bereits für eine andere Stufe eingetragen? -> Fehler
-                    if schueler_entity.stufe != stufe:
-                        raise KlausurplanImportError(f"Zu importierender Plan für die {stufe.name} enthält Schüler "
-                                                     f"({schueler_vorname} {schueler_nachname}, "
-                                                     f"DbIdNr: {schueler_dbid}), der bereits für die "
-                                                     f"{schueler_entity.stufe.name} eingetragen ist.")
-
-                    # Ist derselbe Schüler bereits in dieser Klausur? -> Fehler
-                    if db.session.query(exists().where(and_(Klausurteilnahme.schueler == schueler_entity,
-                                                            Klausurteilnahme.klausur == klausur_entity))).scalar():
-                        raise KlausurplanImportError(f"Zu importierender Plan für die {stufe.name} enthält selben "
-                                                     f"Schüler ({schueler_vorname} {schueler_nachname}, "
-                                                     f"DbIdNr: {schueler_dbid}) mehrfach in "
-                                                     f"derselben Klausur ({kursname}).")
+                    archiv = stack.enter_context(zipfile.ZipFile(file))
+                    dateien = [info for info in archiv.infolist() if not info.is_dir()]
+                    if len(dateien) != 1:
+                        raise KlausurplanImportError(f"Das ZIP-Archiv {dateiname} für die {stufe_name} muss genau "
+                                                     f"eine Klausurplandatei enthalten, enthält aber {len(dateien)}.")
+                    entpackt = stack.enter_context(archiv.open(dateien[0]))
+                    entpackt_name = dateien[0].filename
 
-                # Falls der Schüler die Klausur mitschreibt, zur Klausur hinzufügen
-                if schueler.attributes["Klausurschreiber"].value == "j":
-                    klausurteilnahme = Klausurteilnahme(klausur=klausur_entity, schueler=schueler_entity)
-                    db.session.add(klausurteilnahme)
+                return _plan_lesen(entpackt, entpackt_name, stufe_name)
+        except (OSError, EOFError, zipfile.BadZipFile, zlib.error) as exc:
+            raise KlausurplanImportError(f"Die komprimierte Datei {dateiname} für die {stufe_name} konnte nicht "
+                                         f"entpackt werden ({type(exc).__name__}: {exc}).") from exc
+
+
+def _plan_lesen(file: BinaryIO, dateiname: str, stufe_name: str) -> Planinhalt:
+    if dateiname.endswith(".xml"):
+        return kurs42_lesen(file, stufe_name)
+    # ELSE
+    return csv_lesen(file, stufe_name)
+
+
+def plaene_lesen(plaene: List[Tuple[str, str, str]], prozesse: Optional[int] = None) -> Iterator[Planinhalt]:
+    """
+    Liest mehrere Klausurpläne mit :func:`plan_lesen` gleichzeitig in einem Prozesspool ein.
+
+    :param plaene: Liste aus Tupeln mit den Argumenten für :func:`plan_lesen`
+    :param prozesse: maximale Anzahl der Prozesse (Voreinstellung: ``import.prozesse`` aus der Konfiguration bzw. die
+        Anzahl der Prozessorkerne)
+    :return: Iterator über die eingelesenen Pläne in der Reihenfolge von ``plaene``; ist beim Einlesen eines Plans ein
+        Fehler aufgetreten, wird dieser beim Abrufen des Plans ausgelöst
+    """
+    if prozesse is None:
+        prozesse = (config.get("import") or {}).get("prozesse", None) or os.cpu_count() or 1
+
+    if len(plaene) <= 1 or prozesse <= 1:
+        # Für einen einzelnen Plan lohnt sich kein eigener Prozess
+        return (plan_lesen(*plan) for plan in plaene)
+
+    # Die Pläne werden sofort eingelesen, nicht erst beim Abrufen des ersten Ergebnisses. Die Prozesse werden neu
+    # gestartet statt geforkt, da der Import in einem Thread läuft und ein Fork gehaltene Sperren mitkopieren würde
+    pool = ProcessPoolExecutor(max_workers=min(prozesse, len(plaene)), mp_context=multiprocessing.get_context("spawn"))
+    return _ergebnisse(pool, [pool.submit(plan_lesen, *plan) for plan in plaene])
+
+
+def _ergebnisse(pool: ProcessPoolExecutor, futures: List[Future]) -> Iterator:
+    try:
+        for future in futures:
+            yield future.result()
+    finally:
+        # Nach einem Fehler nicht abwarten, bis die übrigen Pläne eingelesen sind
+        for future in futures:
+            future.cancel()
+        pool.shutdown(wait=False)
+
+
+def lehrer_pwd_hash(new_lehrer_pwd: str) -> bytes:
+    """
+    :param new_lehrer_pwd: Passwort für neu registrierte Lehrerkonten
+    :return: bcrypt-Hash des Passworts
+    """
+    assert util.validate_bcrypt_password(new_lehrer_pwd)
+
+    return bcrypt.hashpw(new_lehrer_pwd.encode("utf-8"), bcrypt.gensalt())
+
+
+def plan_abgleichen(inhalt: Planinhalt, stufe: Stufe, new_lehrer_pwd_hash: bytes,
+                    schueler_daten: Optional[Dict[int, Tuple[str, str, str]]] = None,
+                    datei_hash_: Optional[str] = None) -> Planabgleich:
+    """
+    Ordnet den Schülern eines eingelesenen Plans ihre IDs zu und gleicht den Plan mit den bestehenden Daten der Stufe
+    ab, ohne etwas in die Datenbank zu schreiben.
+
+    :param inhalt: mit :func:`csv_lesen` bzw. :func:`kurs42_lesen` eingelesener Plan
+    :param stufe: Stufe, für die der Plan importiert werden soll
+    :param new_lehrer_pwd_hash: Passwort-Hash für neu registrierte Lehrerkonten
+    :param schueler_daten: siehe :class:`Planabgleich`
+    :param datei_hash_: mit dem Plan zu speichernder Hash der Datei (siehe :func:`datei_hash`)
+    :return: Abgleich mit den vorgemerkten Änderungen (siehe :meth:`Planabgleich.uebernehmen`)
+    """
+    abgleich = Planabgleich(stufe, new_lehrer_pwd_hash, schueler_daten)
+    abgleich.datei_hash = datei_hash_
+
+    zuordnen = _kurs42_schueler_zuordnen if inhalt.kurs42 else _csv_schueler_zuordnen
+    schueler_ids = []
+    schueler_werte = {}
+    for angaben in inhalt.schueler:
+        werte = zuordnen(abgleich, angaben)
+        schueler_ids.append(werte["id"])
+        schueler_werte.setdefault(werte["id"], werte)
+
+    teilnahmen = [(klausur_index, schueler_ids[schueler_index])
+                  for klausur_index, schueler_index in zip(inhalt.teilnahmen_klausuren, inhalt.teilnahmen_schueler)]
+
+    abgleich.hinzufuegen(inhalt.klausuren, schueler_werte, teilnahmen)
+    abgleich.zusammenfassung = (f"{len(inhalt.klausuren)} Klausuren, {len(schueler_werte)} Schüler, "
+                                f"{len(teilnahmen)} Klausurteilnahmen")
+    return abgleich.abschliessen()
+
+
+def datei_hash(pfad: str) -> str:
+    """
+    Berechnet den Hash einer hochgeladenen Klausurplandatei. Stimmt er mit dem beim letzten Import der Stufe
+    gespeicherten Hash (``Stufe.import_hash``) überein, muss die Datei nicht erneut importiert werden.
+
+    :param pfad: Pfad der Datei
+    :return: SHA-256-Hash als Hexadezimalstring
+    """
+    sha = hashlib.sha256()
+    with open(pfad, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _csv_schueler_zuordnen(abgleich: Planabgleich, angaben: Tuple) -> Dict:
+    """
+    :param abgleich: Abgleich des Plans
+    :param angaben: Angaben eines Schülers aus einem CSV-Plan (siehe :attr:`Planinhalt.schueler`)
+    :return: Spaltenwerte des Schülers
+    """
+    (nachname, vorname, birthdate, rownum) = angaben
+    stufe_name = abgleich.stufe.name
+
+    if vorname is None:
+        schueler_id = abgleich.koop_schueler_id(nachname)
+        return {"id": schueler_id, "nachname": nachname, "vorname": "???", "stufe_name": stufe_name, "koop": True}
+
+    # Bereits eingetragene Schüler: ID -> (Nachname, Vorname, Stufe)
+    schueler_daten = abgleich.schueler_daten
+
+    for nr in range(100):
+        test_id = birthdate * 100 + nr
+        test_schueler = schueler_daten.get(test_id)
+        if test_schueler is None:
+            schueler_id = test_id
+            schueler_daten[schueler_id] = (nachname, vorname, stufe_name)
+            break
+        elif test_schueler[0] == nachname and test_schueler[1] == vorname:
+            # Ist dieser Schüler bereits für eine andere Stufe eingetragen? -> Fehler
+            if test_schueler[2] != stufe_name:
+                raise KlausurplanImportError(f"Zu importierender Plan für die {stufe_name} enthält Schüler "
+                                             f"({vorname} {nachname}, {birthdate}), der bereits für die "
+                                             f"{test_schueler[2]} eingetragen ist "
+                                             f"(Zeile: {rownum}).")
+            schueler_id = test_id
+            break
+    else:
+        raise KlausurplanImportError(f"Zu importierender Plan für Stufe {stufe_name} enthält Schüler "
+                                     f"({vorname} {nachname}, {birthdate}; Zeile: {rownum}), dem keine ID "
+                                     f"gegeben werden konnte.")
+
+    return {"id": schueler_id, "nachname": nachname, "vorname": vorname, "stufe_name": stufe_name}
+
+
+def _kurs42_schueler_zuordnen(abgleich: Planabgleich, angaben: Tuple) -> Dict:
+    """
+    :param abgleich: Abgleich des Plans
+    :param angaben: Angaben eines Schülers aus einem Kurs42-Plan (siehe :attr:`Planinhalt.schueler`)
+    :return: Spaltenwerte des Schülers
+    """
+    (schueler_dbid, schueler_nachname, schueler_vorname) = angaben
+    stufe_name = abgleich.stufe.name
+
+    # eventuell bereits eingetragenen Schüler bekommen
+    schueler_entry = abgleich.schueler_daten.get(schueler_dbid)
+
+    # Falls der Schüler noch nicht eingetragen ist, eintragen
+    if schueler_entry is None:
+        abgleich.schueler_daten[schueler_dbid] = (schueler_nachname, schueler_vorname, stufe_name)
+
+    # Ist dieser Schüler bereits für eine andere Stufe eingetragen? -> Fehler
+    elif schueler_entry[2] != stufe_name:
+        raise KlausurplanImportError(f"Zu importierender Plan für die {stufe_name} enthält Schüler "
+                                     f"({schueler_vorname} {schueler_nachname}, "
+                                     f"DbIdNr: {schueler_dbid}), der bereits für die "
+                                     f"{schueler_entry[2]} eingetragen ist.")
+
+    return {"id": schueler_dbid, "nachname": schueler_nachname, "vorname": schueler_vorname,
+            "stufe_name": stufe_name}
+
+
+def _koop_lk_index() -> Dict[Tuple[str, str], List[Tuple[int, str]]]:
+    """
+    :return: Dictionary, das (mit :func:`_nocase` normalisiertem) Lehrerkürzel und Fach die IDs und Stufen der
+        Leistungskursklausuren des Lehrers in diesem Fach zuordnet (z.B. ``("abc", "D")`` für ``D-L1``)
+    """
+    index = {}
+    for klausur_id, kursname, stufe_name, lehrer_kuerzel in \
+            db.session.query(Klausur.id, Klausur.kursname, Klausur.stufe_name, Lehrer.kuerzel) \
+            .join(Lehrer, Klausur.lehrer_id == Lehrer.id).order_by(Klausur.id):
+        if kursname[-4:-2] in ("-L", " L"):
+            index.setdefault((_nocase(lehrer_kuerzel), kursname[:-4]), []).append((klausur_id, stufe_name))
+
+    return index
 
 
 # Von Johannes
 def import_excel_koop(filepath: str):
     # Initialisiert Startdaten
     if Stufe.import_date is not None:
-        workbook = load_workbook(filepath)
-        worksheet = workbook["Datenblatt"]
-        schueler = []
-        exceptions = []
-
-        # Holt die Daten der Schüler aus der Exceltabelle
-        i = 10
+        workbook = load_workbook(filepath, read_only=True)
+        try:
+            worksheet = workbook["Datenblatt"]
+
+            # Holt die Daten der Schüler (Spalten C bis F) aus der Exceltabelle
+            zeilen = []
+            for zeile in worksheet.iter_rows(min_row=10, min_col=3, max_col=6, values_only=True):
+                if zeile[0] is None:
+                    break
+                zeilen.append(zeile)
+        finally:
+            workbook.close()
 
-        while worksheet.cell(row=i, column=3).value is not None and worksheet.cell(row=i + 1,
-                                                                                   column=3).value is not None:
-            if worksheet.cell(row=i, column=3).value is not None:
-                schueler.append([worksheet.cell(row=i, column=6).value, worksheet.cell(row=i, column=3).value,
-                                 worksheet.cell(row=i, column=4).value])
-            i += 1
+        # Wie bisher wird die letzte Zeile vor der ersten Leerzeile nicht übernommen
+        zeilen = zeilen[:-1]
 
         # Spalten die Daten in ihre Bestandteile
-        i = 0
-        i2 = 0
-        i3 = 0
+        schueler = []
+        for kurs, koop_schule, _, name in zeilen:
+            nachname, _, vorname = name.partition(",")
+            fach, _, lehrer = kurs.partition(" ")
+            schueler.append([nachname, vorname[1:], fach, lehrer[1:-1], koop_schule])
 
-        while i < len(schueler):
-            while i2 < len(schueler[i][0]):
-                if schueler[i][0][i2] == ",":
-                    break
-                i2 += 1
-            while i3 < len(schueler[i][1]):
-                if schueler[i][1][i3] == " ":
-                    break
-                i3 += 1
-            schueler[i] = [schueler[i][0][:i2], schueler[i][0][i2 + 2:], schueler[i][1][:i3], schueler[i][1][i3 + 2:-1],
-                           schueler[i][2]]
-            i2 = 0
-            i3 = 0
-            i += 1
+        lk_index = _koop_lk_index()
+
+        neue_schueler = []
+        teilnahmen = []
+        exceptions = []
 
         # s 0 Nachname, 1 Vorname, 2 Fach , 3 Lehrer, 4 KOOP_Schuhle
         # Erstellt für jeden schüler einen Eintrag und prüft ob die Lks und Koopschulen existieren
         for s in schueler:
             if s[2] == "E":
                 s[2] = "E5"
-            klausuren = Klausur.query.join(Lehrer).filter(Lehrer.kuerzel == s[3]).all()
-            i = 0
-            while i < len(klausuren):
-                if klausuren[i].kursname[:-2] in ((str(s[2]) + suffix) for suffix in ("-L", " L")):
-                    i += 1
-                else:
-                    klausuren.pop(i)
-            if len(klausuren) > 0:
-                schueler_entity = Schueler(id=get_next_new_schueler_id(), nachname=s[0], vorname=s[1],
-                                           stufe=klausuren[0].stufe, koop=True)
-                for klausur in klausuren:
-                    teilnahme_entity = Klausurteilnahme(klausur=klausur, schueler=schueler_entity)
-                    db.session.add(schueler_entity)
-                    db.session.add(teilnahme_entity)
+            klausuren = lk_index.get((_nocase(s[3]), s[2]))
+            if klausuren:
+                schueler_id = get_next_new_schueler_id()
+                neue_schueler.append({"id": schueler_id, "nachname": s[0], "vorname": s[1],
+                                      "stufe_name": klausuren[0][1], "koop": True})
+                teilnahmen.extend({"klausur_id": klausur_id, "schueler_id": schueler_id}
+                                  for klausur_id, _ in klausuren)
             else:
                 exceptions.append(s)
 
+        db.session.bulk_insert_mappings(Schueler, neue_schueler)
+        db.session.bulk_insert_mappings(Klausurteilnahme, teilnahmen)
+
         return exceptions
     else:
         raise KoopSchuelerImportError("Für die Stufe ist noch kein Klausurplan importiert")
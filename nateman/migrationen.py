@@ -0,0 +1,147 @@
+# NateMan – Nachschreibtermin-Manager
+# migrationen.py
+# Copyright © 2020  Niklas Elsbrock
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Versionierte Migrationen des Datenbankschemas.
+
+``db.create_all()`` legt nur fehlende Tabellen an und ändert bestehende Datenbanken nicht. Änderungen an bestehenden
+Tabellen (neue Spalten, Indizes usw.) werden deshalb als Migration an :data:`MIGRATIONEN` angehängt. Beim Start
+werden alle Migrationen ausgeführt, die für die Datenbank noch nicht ausgeführt wurden; die Anzahl der ausgeführten
+Migrationen steht in der Tabelle :class:`models.Schemaversion`. Neu erstellte Datenbanken haben bereits das aktuelle
+Schema, daher werden für sie keine Migrationen ausgeführt.
+
+Bereits veröffentlichte Migrationen dürfen nicht mehr geändert oder umsortiert werden.
+
+Außerdem können mit :func:`datenbank_kopieren` alle Daten einer Datenbank in eine andere (z.B. von der
+SQLite-Datenbank in eine PostgreSQL-Datenbank) kopiert werden.
+"""
+
+from typing import Callable, Dict, List
+
+import sqlalchemy
+from flask import Flask
+from sqlalchemy.engine import Connection
+
+from .models import Klausur, Klausurteilnahme, Schemaversion, Session, db
+
+
+def _stufe_importspalten(connection: Connection) -> None:
+    """Spalten für Hash und Zusammenfassung des letzten Imports einer Stufe"""
+    vorhanden = {spalte["name"] for spalte in sqlalchemy.inspect(connection).get_columns("stufe")}
+    # Die Spalten können bereits existieren, da sie zunächst ohne Migration beim Start ergänzt wurden
+    for spalte in ("import_hash", "import_zusammenfassung"):
+        if spalte not in vorhanden:
+            connection.execute(sqlalchemy.text(f"ALTER TABLE stufe ADD COLUMN {spalte} VARCHAR"))
+
+
+def _zugriffsindizes(connection: Connection) -> None:
+    """Indizes für die häufigsten Abfragen von Klausuren, Klausurteilnahmen und Sitzungen"""
+    for tabelle in (Klausur.__table__, Klausurteilnahme.__table__, Session.__table__):
+        for index in tabelle.indexes:
+            index.create(connection, checkfirst=True)
+
+
+MIGRATIONEN: List[Callable[[Connection], None]] = [
+    _stufe_importspalten,
+    _zugriffsindizes,
+]
+""" Alle Migrationen in der Reihenfolge, in der sie ausgeführt werden """
+
+
+def migrieren(app: Flask) -> None:
+    """
+    Erstellt fehlende Tabellen und bringt das Schema einer bestehenden Datenbank auf den aktuellen Stand.
+
+    :param app: Flask-App
+    """
+    neue_datenbank = not sqlalchemy.inspect(db.engine).has_table(Klausur.__tablename__)
+    db.create_all()
+
+    with db.engine.begin() as connection:
+        version = connection.execute(sqlalchemy.select(Schemaversion.version)).scalar()
+        if version is None:
+            # Datenbanken aus der Zeit vor den Migrationen haben noch keine Version
+            version = len(MIGRATIONEN) if neue_datenbank else 0
+            connection.execute(sqlalchemy.insert(Schemaversion).values(version=version))
+
+        if version >= len(MIGRATIONEN):
+            return
+
+        # ELSE
+
+        for nr in range(version, len(MIGRATIONEN)):
+            MIGRATIONEN[nr](connection)
+            app.logger.info(f"Migration {nr + 1} ({MIGRATIONEN[nr].__doc__}) wurde ausgeführt.")
+
+        connection.execute(sqlalchemy.update(Schemaversion).values(version=len(MIGRATIONEN)))
+
+
+def datenbank_kopieren(quelle_uri: str, batchgroesse: int = 1000,
+                       fortschritt: Callable[[str, int], None] = lambda tabelle, anzahl: None) -> Dict[str, int]:
+    """
+    Kopiert alle Daten aus der Datenbank ``quelle_uri`` in die Datenbank der App und ersetzt dabei deren bisherige
+    Daten. Die Zeilen werden blockweise gelesen und eingefügt, gespeichert wird alles in einer Transaktion.
+
+    :param quelle_uri: SQLAlchemy-URI der Quelldatenbank; sie muss das aktuelle Schema haben
+    :param batchgroesse: Anzahl der Zeilen, die auf einmal gelesen und eingefügt werden
+    :param fortschritt: wird nach jedem Block mit dem Tabellennamen und der Anzahl der bisher kopierten Zeilen
+        der Tabelle aufgerufen
+    :return: Dictionary, das den Tabellennamen die Anzahl der kopierten Zeilen zuordnet
+    :raises ValueError: falls die Quelldatenbank nicht das aktuelle Schema hat
+    """
+    tabellen = [tabelle for tabelle in db.metadata.sorted_tables if tabelle is not Schemaversion.__table__]
+    anzahlen = {}
+
+    quelle = sqlalchemy.create_engine(quelle_uri)
+    try:
+        with quelle.connect() as quell_connection, db.engine.begin() as ziel_connection:
+            if not sqlalchemy.inspect(quell_connection).has_table(Schemaversion.__tablename__) \
+                    or quell_connection.execute(sqlalchemy.select(Schemaversion.version)).scalar() \
+                    != len(MIGRATIONEN):
+                raise ValueError("Die Quelldatenbank hat nicht das aktuelle Schema. Bitte starten Sie NateMan zuvor "
+                                 "einmal mit der Quelldatenbank, damit die Migrationen ausgeführt werden.")
+
+            # ELSE
+
+            # Bisherige Daten (z.B. die beim Start angelegten Stufen und das Administratorkonto) entfernen
+            for tabelle in reversed(tabellen):
+                ziel_connection.execute(tabelle.delete())
+
+            for tabelle in tabellen:
+                anzahlen[tabelle.name] = 0
+                zeilen = quell_connection.execution_options(yield_per=batchgroesse).execute(tabelle.select())
+                for block in zeilen.partitions():
+                    ziel_connection.execute(tabelle.insert(), [dict(zeile._mapping) for zeile in block])
+                    anzahlen[tabelle.name] += len(block)
+                    fortschritt(tabelle.name, anzahlen[tabelle.name])
+
+            if ziel_connection.dialect.name == "postgresql":
+                _sequenzen_anpassen(ziel_connection, tabellen)
+    finally:
+        quelle.dispose()
+
+    return anzahlen
+
+
+def _sequenzen_anpassen(connection: Connection, tabellen: List[sqlalchemy.Table]) -> None:
+    """Setzt in PostgreSQL die Sequenzen der automatisch hochgezählten IDs hinter die größte kopierte ID"""
+    for tabelle in tabellen:
+        spalte = tabelle.autoincrement_column
+        if spalte is not None:
+            connection.execute(sqlalchemy.text(
+                f"SELECT setval(pg_get_serial_sequence('{tabelle.name}', '{spalte.name}'), "
+                f"COALESCE(MAX({spalte.name}), 0) + 1, false) FROM {tabelle.name}"))
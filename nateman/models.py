@@ -18,21 +18,48 @@
 """
 Enthält die SQLAlchemy-Modelle.
 """
+import json
+import os
 from datetime import datetime, timedelta
 from sqlite3 import Connection as Sqlite3_Connection
-from typing import Optional, Tuple, Union, AnyStr
+from typing import AnyStr, Dict, Optional, Tuple, Union
 
 import bcrypt
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import CheckConstraint
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session as OrmSession
 from sqlalchemy.sql import func
 
 from . import util
+from .config_manager import config
 
 db: SQLAlchemy = SQLAlchemy()
 
 
+def _nocase_string():
+    """
+    :return: String-Typ, bei dem Groß- und Kleinschreibung beim Vergleichen und Sortieren nicht unterschieden wird
+        (SQLite: Kollation ``NOCASE``, PostgreSQL: ICU-Kollation ``nateman_nocase``, siehe
+        :func:`postgresql_kollation_erstellen`). ``NOCASE`` berücksichtigt nur die Buchstaben A-Z, die ICU-Kollation
+        alle Buchstaben (z.B. auch "Ä" und "ä").
+    """
+    return db.String() \
+        .with_variant(db.String(collation="NOCASE"), "sqlite") \
+        .with_variant(db.String(collation="nateman_nocase"), "postgresql")
+
+
+@db.event.listens_for(db.metadata, "before_create")
+def postgresql_kollation_erstellen(target, connection, **kwargs):
+    """
+    Erstellt in PostgreSQL-Datenbanken vor dem Anlegen der Tabellen die Kollation für :func:`_nocase_string`.
+    """
+    if connection.dialect.name == "postgresql":
+        connection.execute(db.text("CREATE COLLATION IF NOT EXISTS nateman_nocase "
+                                   "(provider = icu, locale = 'und-u-ks-level2', deterministic = false)"))
+
+
 class Klausurteilnahme(db.Model):
     klausur_id = db.Column(db.Integer, db.ForeignKey("klausur.id", onupdate="CASCADE", ondelete="CASCADE"),
                            primary_key=True)
@@ -45,16 +72,26 @@ class Klausurteilnahme(db.Model):
     klausur = db.relationship("Klausur", lazy="joined")
     schueler = db.relationship("Schueler", lazy="joined")
 
+    __table_args__ = (
+        db.Index("ix_klausurteilnahme_schueler", schueler_id),
+        # Teilindex für die noch nachzuschreibenden Klausuren (Nachschreibplan, Versäumnisliste)
+        db.Index("ix_klausurteilnahme_nachzuschreiben", klausur_id, schueler_id,
+                 sqlite_where=db.and_(versaeumt, ~nachgeschrieben),
+                 postgresql_where=db.and_(versaeumt, ~nachgeschrieben)),
+    )
+
 
 class Stufe(db.Model):
     name = db.Column(db.String(), primary_key=True)
     import_date = db.Column(db.Date(), default=None)
+    import_hash = db.Column(db.String(), default=None)  # SHA-256 der zuletzt importierten Datei
+    import_zusammenfassung = db.Column(db.String(), default=None)
 
 
 class Schueler(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    nachname = db.Column(db.String(collation="NOCASE"), nullable=False)
-    vorname = db.Column(db.String(collation="NOCASE"), nullable=False)
+    nachname = db.Column(_nocase_string(), nullable=False)
+    vorname = db.Column(_nocase_string(), nullable=False)
     stufe_name = db.Column(db.String(), db.ForeignKey("stufe.name", onupdate="CASCADE", ondelete="CASCADE"),
                            nullable=False)
     koop = db.Column(db.Boolean, default=False, nullable=False)
@@ -67,7 +104,7 @@ class Schueler(db.Model):
 
 class Lehrer(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    kuerzel = db.Column(db.String(collation="NOCASE"), unique=True, nullable=False)
+    kuerzel = db.Column(_nocase_string(), unique=True, nullable=False)
     email = db.Column(db.String())
     is_confirmed = db.Column(db.Boolean, default=False, nullable=False)
     pwd_hash = db.Column(db.String(), nullable=False)
@@ -109,19 +146,24 @@ class Lehrer(db.Model):
         # ELSE
         return self.beraet == stufe
 
-    def accessible_stufen(self, names: bool = False) -> Union[Tuple[Stufe, ...], Tuple[AnyStr, ...]]:
+    def accessible_stufen(self, names: bool = False) -> Union[Tuple["stammdaten.StufeDaten", ...], Tuple[AnyStr, ...]]:
         """
-        :param names: Falls ``True``, werden die Namen der Stufen anstelle der Stufenobjekte zurückgegeben
+        Die Stufen werden aus dem Zwischenspeicher (siehe :mod:`stammdaten`) gelesen.
+
+        :param names: Falls ``True``, werden die Namen der Stufen anstelle der Stufendaten zurückgegeben
         :return: Tupel mit allen Stufen, auf die dieser Lehrer erweiterten Zugriff hat
         """
-        stufen = Stufe.query.all()
+        from . import stammdaten
         if self.is_admin:
-            return tuple(stufen) if not names else tuple(s.name for s in stufen)
-        # ELSE
-        if self.beraet:
-            return (self.beraet,) if not names else (self.beraet.name,)
+            stufen = stammdaten.stufen()
+        elif self.beraet_name is not None:
+            stufen = tuple(stufe for stufe in stammdaten.stufen() if stufe.name == self.beraet_name)
+        else:
+            return ()
+
         # ELSE
-        return ()
+
+        return tuple(stufe.name for stufe in stufen) if names else stufen
 
     def set_password(self, new_password: str, set_pwd_changed=True) -> None:
         """
@@ -156,7 +198,7 @@ class Lehrer(db.Model):
 
 class Klausur(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    kursname = db.Column(db.String(collation="NOCASE"), nullable=False)
+    kursname = db.Column(_nocase_string(), nullable=False)
     date = db.Column(db.Date, nullable=False)
     startperiod = db.Column(db.Integer, nullable=False)
     endperiod = db.Column(db.Integer, nullable=False)
@@ -173,7 +215,9 @@ class Klausur(db.Model):
 
     __table_args__ = (
         CheckConstraint("startperiod >= 0"),
-        CheckConstraint("startperiod <= endperiod")
+        CheckConstraint("startperiod <= endperiod"),
+        db.Index("ix_klausur_stufe_date", stufe_name, date),
+        db.Index("ix_klausur_lehrer_date", lehrer_id, date),
     )
 
     def __str__(self):
@@ -194,6 +238,10 @@ class Session(db.Model):
 
     lehrer = db.relationship("Lehrer", lazy="joined")
 
+    __table_args__ = (
+        db.Index("ix_session_expiry", expiry),
+    )
+
     @staticmethod
     def get(key: str) -> Optional["Session"]:
         """
@@ -237,25 +285,251 @@ class Session(db.Model):
         return self.expiry < datetime.utcnow()
 
 
+class Terminzuordnung(db.Model):
+    """Zwischengespeicherte Zuordnung der nachzuschreibenden Klausuren einer Stufe zu Nachschreibterminen"""
+    stufe_name = db.Column(db.String(), db.ForeignKey("stufe.name", onupdate="CASCADE", ondelete="CASCADE"),
+                           primary_key=True)
+    inhalt_hash = db.Column(db.String(), nullable=False)
+    kurs_termine = db.Column(db.String(), nullable=False)
+
+    @staticmethod
+    def get(stufe: Stufe, inhalt_hash: str) -> Optional[Dict[int, int]]:
+        """
+        Gibt die gespeicherte Zuordnung der Stufe zurück, falls sie zum angegebenen Hash gehört.
+
+        :param stufe: Stufe
+        :param inhalt_hash: Hash der zuzuordnenden Daten (siehe :func:`scheduler.inhalt_hash`)
+        :return: Dictionary, das Klausur-IDs ihren Termin zuordnet, oder ``None``
+        """
+        zuordnung = Terminzuordnung.query.filter_by(stufe_name=stufe.name, inhalt_hash=inhalt_hash).first()
+        if zuordnung is None:
+            return None
+
+        return {int(klausur_id): termin for klausur_id, termin in json.loads(zuordnung.kurs_termine).items()}
+
+    @staticmethod
+    def speichern(stufe: Stufe, inhalt_hash: str, kurs_termine: Dict[int, int]) -> None:
+        """
+        Speichert die Zuordnung der Stufe und ersetzt dabei eine eventuell vorhandene.
+        In SQLite und PostgreSQL geschieht das mit einer einzigen Anweisung (``INSERT ... ON CONFLICT``), damit zwei
+        gleichzeitige Exporte derselben Stufe nicht beide versuchen, die Zuordnung neu einzufügen.
+
+        :param stufe: Stufe
+        :param inhalt_hash: Hash der zuzuordnenden Daten (siehe :func:`scheduler.inhalt_hash`)
+        :param kurs_termine: Dictionary, das Klausur-IDs ihren Termin zuordnet
+        """
+        werte = {"stufe_name": stufe.name, "inhalt_hash": inhalt_hash, "kurs_termine": json.dumps(kurs_termine)}
+
+        dialekte = {"sqlite": sqlite, "postgresql": postgresql}
+        dialekt = dialekte.get(db.engine.dialect.name)
+        if dialekt is None:
+            db.session.merge(Terminzuordnung(**werte))
+            return
+
+        # ELSE
+
+        tabelle = Terminzuordnung.__table__
+        anweisung = dialekt.insert(tabelle).values(werte)
+        db.session.execute(anweisung.on_conflict_do_update(
+            index_elements=[tabelle.c.stufe_name],
+            set_={"inhalt_hash": anweisung.excluded.inhalt_hash, "kurs_termine": anweisung.excluded.kurs_termine}))
+
+
+class Auftrag(db.Model):
+    """Im Hintergrund ausgeführter Auftrag wie ein Import oder Export (siehe :mod:`auftraege`)"""
+
+    WARTEND = "wartend"
+    LAUFEND = "laufend"
+    FERTIG = "fertig"
+    FEHLGESCHLAGEN = "fehlgeschlagen"
+
+    ABGEBROCHEN_MELDUNG = "Der Auftrag wurde abgebrochen, vermutlich durch einen Neustart von NateMan. Bitte starten " \
+                          "Sie ihn erneut."
+
+    id = db.Column(db.String(), primary_key=True)
+    art = db.Column(db.String(), nullable=False)
+    lehrer_id = db.Column(db.Integer, db.ForeignKey("lehrer.id", onupdate="CASCADE", ondelete="CASCADE"))
+    status = db.Column(db.String(), nullable=False, default=WARTEND)
+    fortschritt = db.Column(db.Float, nullable=False, default=0.0)
+    schritt = db.Column(db.String())
+    meldung = db.Column(db.String())
+    meldung_kategorie = db.Column(db.String())
+    ergebnis_datei = db.Column(db.String())
+    ergebnis_name = db.Column(db.String())
+    erstellt = db.Column(db.DateTime, nullable=False)
+    beendet = db.Column(db.DateTime)
+
+    lehrer = db.relationship("Lehrer", lazy="select")
+
+    @staticmethod
+    def cleanup(max_alter: timedelta = timedelta(days=1)) -> None:
+        """
+        Entfernt alle Aufträge, die älter als ``max_alter`` sind, aus der Datenbank und löscht deren Ergebnisdateien.
+        Noch nicht beendete Aufträge, die so alt sind, wurden durch einen Neustart abgebrochen.
+        """
+        alte_auftraege = Auftrag.query.filter(Auftrag.erstellt < datetime.utcnow() - max_alter)
+        for auftrag in alte_auftraege:
+            if auftrag.ergebnis_datei is not None and os.path.isfile(auftrag.ergebnis_datei):
+                os.remove(auftrag.ergebnis_datei)
+        alte_auftraege.delete()
+
+    @staticmethod
+    def abgebrochene_beenden(max_dauer: timedelta) -> None:
+        """
+        Markiert alle Aufträge, die länger als ``max_dauer`` nicht beendet wurden, als fehlgeschlagen. Da die
+        Aufträge im Prozess ausgeführt werden, der sie gestartet hat, wurden sie in der Regel durch einen Neustart
+        abgebrochen.
+        """
+        Auftrag.query.filter(Auftrag.status.in_((Auftrag.WARTEND, Auftrag.LAUFEND)),
+                             Auftrag.erstellt < datetime.utcnow() - max_dauer) \
+            .update({"status": Auftrag.FEHLGESCHLAGEN, "fortschritt": 1.0, "schritt": None,
+                     "meldung": Auftrag.ABGEBROCHEN_MELDUNG, "meldung_kategorie": "error",
+                     "beendet": datetime.utcnow()}, synchronize_session=False)
+
+    def ist_abgebrochen(self, max_dauer: timedelta) -> bool:
+        """
+        :return: ``True``, falls der Auftrag länger als ``max_dauer`` nicht beendet wurde (siehe
+            :meth:`abgebrochene_beenden`), ``False``, falls nicht
+        """
+        return not self.ist_beendet() and self.erstellt < datetime.utcnow() - max_dauer
+
+    def ist_beendet(self) -> bool:
+        """
+        :return: ``True``, falls der Auftrag abgeschlossen oder fehlgeschlagen ist, ``False``, falls nicht
+        """
+        return self.status in (Auftrag.FERTIG, Auftrag.FEHLGESCHLAGEN)
+
+    def fortschritt_melden(self, fortschritt: float, schritt: str) -> None:
+        """
+        Speichert den Fortschritt des Auftrags sofort über eine eigene Verbindung, damit er auch während einer noch
+        offenen Transaktion des Auftrags abgefragt werden kann.
+        Hat die Transaktion des Auftrags in SQLite bereits geschrieben, ist die Datenbank (und ggf. die Schreibsperre)
+        bis zu deren Ende belegt, sodass die eigene Verbindung warten müsste; der Fortschritt wird dann nicht
+        gespeichert.
+
+        :param fortschritt: Anteil der bereits erledigten Arbeit (0 bis 1)
+        :param schritt: Beschreibung des aktuellen Schritts
+        """
+        if db.engine.dialect.name == "sqlite" and db.session().in_transaction() \
+                and db.session.connection().connection.driver_connection.in_transaction:
+            return
+
+        # ELSE
+
+        with db.engine.begin() as connection:
+            connection.execute(Auftrag.__table__.update().where(Auftrag.__table__.c.id == self.id)
+                               .values(status=Auftrag.LAUFEND, fortschritt=fortschritt, schritt=schritt))
+
+    def abschliessen(self, meldung: str, kategorie: str = "success", ergebnis_datei: Optional[str] = None,
+                     ergebnis_name: Optional[str] = None) -> None:
+        """
+        Markiert den Auftrag als beendet. Die Änderung wird mit der Transaktion des Auftrags gespeichert.
+
+        :param meldung: Meldung, die nach dem Ende des Auftrags angezeigt wird
+        :param kategorie: Kategorie der Meldung wie bei ``flash``; bei ``"error"`` gilt der Auftrag als fehlgeschlagen
+        :param ergebnis_datei: Pfad der Datei, die nach dem Ende des Auftrags heruntergeladen werden kann
+        :param ergebnis_name: Dateiname für den Download
+        """
+        self.status = Auftrag.FEHLGESCHLAGEN if kategorie == "error" else Auftrag.FERTIG
+        self.fortschritt = 1.0
+        self.schritt = None
+        self.meldung = meldung
+        self.meldung_kategorie = kategorie
+        self.ergebnis_datei = ergebnis_datei
+        self.ergebnis_name = ergebnis_name
+        self.beendet = datetime.utcnow()
+
+
+class Schemaversion(db.Model):
+    """Version des Datenbankschemas, d.h. Anzahl der ausgeführten Migrationen (siehe :mod:`migrationen`)"""
+    version = db.Column(db.Integer, primary_key=True)
+
+
+SQLITE_PRAGMAS = {
+    "journal-mode": ("journal_mode", "WAL"),
+    "synchronous": ("synchronous", "NORMAL"),
+    "cache-size": ("cache_size", -16000),
+    "mmap-size": ("mmap_size", 268435456),
+    "temp-store": ("temp_store", "MEMORY"),
+    "busy-timeout": ("busy_timeout", 5000),
+}
+""" Einstellungen im Abschnitt ``database`` der Konfiguration mit zugehörigem PRAGMA und Standardwert """
+
+
+class Datenversion(db.Model):
+    """Zähler, der bei jeder Änderung der zwischengespeicherten Stammdaten erhöht wird (siehe :mod:`stammdaten`)"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
 @db.event.listens_for(Engine, "connect")
 def set_sqlite_pragma(dbapi_connection, connection_record):
     """
     Falls SQLite verwendet wird, wird bei jedem Verbindungsaufbau zur Datenbank ``foreign_keys`` aktiviert, damit
     Fremdschlüssel richtig funktionieren.
     Von https://stackoverflow.com/questions/4477269.
+
+    Außerdem werden die im Abschnitt ``database`` der Konfiguration angegebenen PRAGMAs gesetzt (siehe
+    :data:`SQLITE_PRAGMAS`). Ein auf ``null`` gesetzter Wert lässt die Voreinstellung von SQLite unverändert.
     """
     if type(dbapi_connection) is Sqlite3_Connection:
+        einstellungen = config.get("database") or {}
+
         cursor = dbapi_connection.cursor()
         cursor.execute("PRAGMA foreign_keys=ON")
+        for schluessel, (pragma, standardwert) in SQLITE_PRAGMAS.items():
+            wert = einstellungen.get(schluessel, standardwert)
+            if wert is not None:
+                cursor.execute(f"PRAGMA {pragma}={wert}")
         cursor.close()
 
 
+class SchuelerIdAllocator:
+    """
+    Vergibt die (negativen) IDs manuell hinzugefügter Schüler und Koopschüler.
+    Die kleinste vergebene ID wird nur einmal pro Transaktion aus der Datenbank gelesen, danach werden die IDs im
+    Speicher heruntergezählt.
+    """
+
+    _SESSION_INFO_KEY = "schueler_id_allocator"
+
+    def __init__(self):
+        lowest_id = db.session.query(func.min(Schueler.id).label("min_id")).one().min_id
+        self._next_id = -1 if lowest_id is None or lowest_id > -1 else lowest_id - 1
+
+    @staticmethod
+    def current() -> "SchuelerIdAllocator":
+        """
+        :return: Allocator der aktuellen Transaktion
+        """
+        allocator = db.session.info.get(SchuelerIdAllocator._SESSION_INFO_KEY)
+        if allocator is None:
+            allocator = SchuelerIdAllocator()
+            db.session.info[SchuelerIdAllocator._SESSION_INFO_KEY] = allocator
+
+        return allocator
+
+    def next_id(self) -> int:
+        """
+        :return: nächste freie ID
+        """
+        next_id = self._next_id
+        self._next_id -= 1
+        return next_id
+
+
+@db.event.listens_for(OrmSession, "after_transaction_end")
+def reset_schueler_id_allocator(session, transaction):
+    """
+    Verwirft den :class:`SchuelerIdAllocator` einer Sitzung am Ende der Transaktion, da dann andere Verbindungen
+    Schüler hinzugefügt oder nach einem Rollback bereits vergebene IDs wieder frei sein können.
+    """
+    if transaction.parent is None:
+        session.info.pop(SchuelerIdAllocator._SESSION_INFO_KEY, None)
+
+
 def get_next_new_schueler_id():
     """
-    :return: ID, die der nächste manuell hinzugefügte Schüler haben soll
+    :return: ID, die der nächste manuell hinzugefügte Schüler haben soll (siehe :class:`SchuelerIdAllocator`)
     """
-    lowest_id = db.session.query(func.min(Schueler.id).label("min_id")).one().min_id
-    if lowest_id is None or lowest_id > -1:
-        return -1
-    # ELSE
-    return lowest_id - 1
+    return SchuelerIdAllocator.current().next_id()
@@ -0,0 +1,531 @@
+# NateMan – Nachschreibtermin-Manager
+# scheduler.py
+# Copyright © 2020  Niklas Elsbrock und Johannes Bingel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Enthält Strategien zur Zuordnung nachzuschreibender Klausuren zu Nachschreibterminen.
+
+Die Zuordnung entspricht einer Färbung des Konfliktgraphen: Kurse, die sich Schüler teilen,
+dürfen nicht denselben Termin (dieselbe Farbe) bekommen. Farbe 0 entspricht Termin 1.
+"""
+
+import concurrent.futures
+import hashlib
+import heapq
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+from . import assigner
+from .assigner import Konfliktgraph, ist_lk, konfliktgraph_erstellen
+from .config_manager import config
+
+
+def vorgabe_erstellen(graph: Konfliktgraph) -> Dict[int, int]:
+    """
+    Legt fest, welche Kurse fest Termin 1 zugeordnet werden.
+    Das sind Kurse mit Koopschülern und Leistungskurse, solange sie untereinander keine Konflikte haben.
+
+    :param graph: Konfliktgraph
+    :return: Dictionary, das den festgelegten Kursindizes ihre Farbe zuordnet
+    """
+    vorgabe: Dict[int, int] = {}
+    for kurs_index in range(graph.anzahl):
+        if not (graph.koop[kurs_index] or graph.lk[kurs_index]):
+            continue
+        if all(nachbar not in vorgabe for nachbar in graph.konflikte.get(kurs_index, ())):
+            vorgabe[kurs_index] = 0
+    return vorgabe
+
+
+def _nachbarfarben(graph: Konfliktgraph, farben: List[int], kurs_index: int) -> Set[int]:
+    return {farben[nachbar] for nachbar in graph.konflikte.get(kurs_index, ()) if farben[nachbar] >= 0}
+
+
+def _kleinste_freie_farbe(belegt: Set[int]) -> int:
+    farbe = 0
+    while farbe in belegt:
+        farbe += 1
+    return farbe
+
+
+def _startfarben(graph: Konfliktgraph, vorgabe: Dict[int, int]) -> List[int]:
+    farben = [-1] * graph.anzahl
+    for kurs_index, farbe in vorgabe.items():
+        farben[kurs_index] = farbe
+    return farben
+
+
+def _vorrang_zuerst(graph: Konfliktgraph, reihenfolge: List[int]) -> List[int]:
+    """Sortiert Kurse mit Koopschülern und Leistungskurse stabil an den Anfang der Reihenfolge."""
+    return sorted(reihenfolge, key=lambda i: not (graph.koop[i] or graph.lk[i]))
+
+
+class Strategie:
+    """
+    Basisklasse der Zuordnungsstrategien.
+    Unterklassen implementieren :meth:`faerben`.
+
+    Strategien können als Kontextmanager verwendet werden, um Ressourcen (z.B. einen Prozesspool) für mehrere
+    Färbungen wiederzuverwenden.
+    """
+
+    name: str = ""
+
+    def __enter__(self) -> "Strategie":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def faerben(self, graph: Konfliktgraph, vorgabe: Dict[int, int]) -> List[int]:
+        """
+        Färbt den Konfliktgraphen.
+
+        :param graph: Konfliktgraph
+        :param vorgabe: bereits festgelegte Farben (Kursindex -> Farbe)
+        :return: Liste, die jedem Kursindex eine Farbe (einen Termin, beginnend bei 0) zuordnet
+        """
+        raise NotImplementedError
+
+    def schluessel(self) -> str:
+        """
+        :return: String, der die Strategie samt ihrer Parameter eindeutig beschreibt (für den Zuordnungscache)
+        """
+        return self.name
+
+
+class HeuristikStrategie(Strategie):
+    """Bisherige Termin-1/Termin-2-Heuristik aus :func:`assigner.termine_berechnen`. Ignoriert die Vorgabe."""
+
+    name = "heuristik"
+
+    def faerben(self, graph: Konfliktgraph, vorgabe: Dict[int, int]) -> List[int]:
+        farben = [0] * graph.anzahl
+        # wie im Export gilt bei mehrfach zugeordneten Kursen der letzte Termin
+        for termin, kurse in enumerate(assigner.termine_berechnen(graph)[0]):
+            for kurs_index in kurse:
+                farben[kurs_index] = termin
+        return farben
+
+
+class GreedyStrategie(Strategie):
+    """
+    Färbt die Kurse nacheinander mit der kleinsten freien Farbe.
+    Die Reihenfolge ist ``"grad"`` (absteigend nach Anzahl der Konflikte), ``"index"`` (Reihenfolge im Graphen)
+    oder ``"zufall"``. Mit ``seed`` werden Gleichstände bzw. die zufällige Reihenfolge ausgewürfelt.
+    """
+
+    name = "greedy"
+
+    REIHENFOLGEN = ("grad", "index", "zufall")
+
+    def __init__(self, reihenfolge: str = "grad", seed: Optional[int] = None):
+        """
+        :param reihenfolge: Reihenfolge, in der die Kurse gefärbt werden
+        :param seed: Startwert des Zufallsgenerators (``None`` für keine Zufälligkeit bei ``"grad"``/``"index"``)
+        """
+        if reihenfolge not in self.REIHENFOLGEN:
+            raise ValueError(f"unknown greedy order '{reihenfolge}'")
+        self.reihenfolge = reihenfolge
+        self.seed = seed
+
+    def schluessel(self) -> str:
+        return f"{self.name}:{self.reihenfolge}:{self.seed}"
+
+    def faerben(self, graph: Konfliktgraph, vorgabe: Dict[int, int]) -> List[int]:
+        farben = _startfarben(graph, vorgabe)
+
+        reihenfolge = list(range(graph.anzahl))
+        if self.seed is not None or self.reihenfolge == "zufall":
+            random.Random(self.seed).shuffle(reihenfolge)
+        if self.reihenfolge == "grad":
+            reihenfolge.sort(key=lambda i: -len(graph.konflikte.get(i, ())))
+
+        for kurs_index in _vorrang_zuerst(graph, reihenfolge):
+            if farben[kurs_index] < 0:
+                farben[kurs_index] = _kleinste_freie_farbe(_nachbarfarben(graph, farben, kurs_index))
+        return farben
+
+
+class DSaturStrategie(Strategie):
+    """
+    DSatur-Verfahren: färbt jeweils den Kurs als nächstes, dessen Nachbarn bereits die meisten
+    verschiedenen Farben haben (bei Gleichstand den mit den meisten Konflikten).
+    """
+
+    name = "dsatur"
+
+    def faerben(self, graph: Konfliktgraph, vorgabe: Dict[int, int]) -> List[int]:
+        farben = _startfarben(graph, vorgabe)
+        reihenfolge = [i for i in _vorrang_zuerst(graph, list(range(graph.anzahl))) if farben[i] < 0]
+
+        # Die Nachbarfarben werden beim Färben eines Kurses bei seinen Nachbarn ergänzt, statt sie für jede Auswahl
+        # neu zu berechnen. Im Heap stehen die Kurse nach Anzahl der Nachbarfarben, Anzahl der Konflikte und Position
+        # in der Reihenfolge; veraltete Einträge werden beim Entnehmen übersprungen.
+        nachbarfarben = [_nachbarfarben(graph, farben, i) for i in range(graph.anzahl)]
+        position = {kurs_index: nr for nr, kurs_index in enumerate(reihenfolge)}
+        heap = [(-len(nachbarfarben[i]), -len(graph.konflikte.get(i, ())), position[i], i) for i in reihenfolge]
+        heapq.heapify(heap)
+
+        while heap:
+            anzahl_nachbarfarben, _, _, kurs_index = heapq.heappop(heap)
+            if farben[kurs_index] >= 0 or -anzahl_nachbarfarben != len(nachbarfarben[kurs_index]):
+                continue
+
+            # ELSE
+
+            farbe = _kleinste_freie_farbe(nachbarfarben[kurs_index])
+            farben[kurs_index] = farbe
+            for nachbar in graph.konflikte.get(kurs_index, ()):
+                if farben[nachbar] < 0 and farbe not in nachbarfarben[nachbar]:
+                    nachbarfarben[nachbar].add(farbe)
+                    heapq.heappush(heap, (-len(nachbarfarben[nachbar]), -len(graph.konflikte.get(nachbar, ())),
+                                          position[nachbar], nachbar))
+
+        return farben
+
+
+class ExakteStrategie(Strategie):
+    """
+    Branch-and-Bound-Verfahren, das eine Färbung mit möglichst wenigen Farben sucht.
+    Startet mit der DSatur-Färbung und gibt nach Ablauf des Zeitbudgets die beste bisher gefundene Färbung zurück.
+    Das Zeitbudget schließt die DSatur-Färbung ein. Die Suche verwendet einen eigenen Stapel statt Rekursion, damit
+    auch Stufen mit sehr vielen Kursen nicht die maximale Rekursionstiefe überschreiten.
+    """
+
+    name = "exakt"
+
+    def __init__(self, zeitbudget: float = 2.0):
+        """
+        :param zeitbudget: maximale Rechenzeit in Sekunden
+        """
+        self.zeitbudget = zeitbudget
+
+    def schluessel(self) -> str:
+        return f"{self.name}:{self.zeitbudget}"
+
+    def faerben(self, graph: Konfliktgraph, vorgabe: Dict[int, int]) -> List[int]:
+        deadline = time.monotonic() + self.zeitbudget
+
+        beste = DSaturStrategie().faerben(graph, vorgabe)
+        beste_anzahl = max(beste, default=-1) + 1
+        untere_schranke = max(_clique_groesse(graph), max(vorgabe.values(), default=-1) + 1)
+
+        if beste_anzahl <= untere_schranke:
+            return beste
+
+        farben = _startfarben(graph, vorgabe)
+        ungefaerbt = {i for i in range(graph.anzahl) if farben[i] < 0}
+
+        # Jeder Eintrag steht für einen gerade gefärbten Kurs: [Kursindex, Nachbarfarben, Anzahl der Farben vor dem
+        # Färben des Kurses, nächste zu probierende Farbe]
+        stapel: List[List] = []
+        anzahl_farben = max(vorgabe.values(), default=-1) + 1
+
+        while True:
+            if time.monotonic() > deadline:
+                break
+
+            if not ungefaerbt:
+                if anzahl_farben < beste_anzahl:
+                    beste = list(farben)
+                    beste_anzahl = anzahl_farben
+                if beste_anzahl <= untere_schranke:
+                    break
+            else:
+                kurs_index = max(ungefaerbt, key=lambda i: (len(_nachbarfarben(graph, farben, i)),
+                                                            len(graph.konflikte.get(i, ())), -i))
+                ungefaerbt.remove(kurs_index)
+                stapel.append([kurs_index, _nachbarfarben(graph, farben, kurs_index), anzahl_farben, 0])
+
+            # Nächste Farbe für den obersten Kurs des Stapels wählen; Kurse, für die keine Farbe mehr übrig ist,
+            # werden wieder entfernt. Eine neue Farbe wird nur probiert, wenn sie noch zu einer besseren Lösung führen
+            # kann.
+            while stapel:
+                eintrag = stapel[-1]
+                kurs_index, belegt, anzahl_vorher, farbe = eintrag
+                while farbe <= anzahl_vorher and farbe < beste_anzahl - 1 and farbe in belegt:
+                    farbe += 1
+                if farbe <= anzahl_vorher and farbe < beste_anzahl - 1:
+                    eintrag[3] = farbe + 1
+                    farben[kurs_index] = farbe
+                    anzahl_farben = max(anzahl_vorher, farbe + 1)
+                    break
+
+                # ELSE
+
+                farben[kurs_index] = -1
+                ungefaerbt.add(kurs_index)
+                stapel.pop()
+            else:
+                break
+
+        return beste
+
+
+def _clique_groesse(graph: Konfliktgraph) -> int:
+    """
+    :return: Größe einer gierig gefundenen Clique im Konfliktgraphen (untere Schranke für die Anzahl der Termine)
+    """
+    beste = 1 if graph.anzahl else 0
+    for start, nachbarn in graph.konflikte.items():
+        clique = {start}
+        for kandidat in sorted(nachbarn, key=lambda i: -len(graph.konflikte.get(i, ()))):
+            if clique <= set(graph.konflikte.get(kandidat, ())):
+                clique.add(kandidat)
+        beste = max(beste, len(clique))
+    return beste
+
+
+def _gueltig(graph: Konfliktgraph, farben: List[int], vorgabe: Dict[int, int]) -> bool:
+    """
+    :return: ``True``, falls keine zwei Kurse mit Konflikt dieselbe Farbe haben und die Vorgabe eingehalten ist
+    """
+    if any(farben[kurs_index] != farbe for kurs_index, farbe in vorgabe.items()):
+        return False
+    return all(farben[kurs_index] != farben[nachbar]
+               for kurs_index, nachbarn in graph.konflikte.items() for nachbar in nachbarn)
+
+
+def _portfolio_faerben(strategie: Strategie, kompakt: Tuple, vorgabe: Dict[int, int]) -> List[int]:
+    """Wird in den Prozessen von :class:`PortfolioStrategie` ausgeführt."""
+    return strategie.faerben(Konfliktgraph.aus_kompakt(kompakt), vorgabe)
+
+
+def _portfolio_bereit() -> None:
+    """Wird in den Prozessen von :class:`PortfolioStrategie` ausgeführt, damit sie vorab gestartet werden."""
+
+
+class PortfolioStrategie(Strategie):
+    """
+    Führt mehrere Strategien gleichzeitig in einem Prozesspool aus und verwendet von den Färbungen,
+    die innerhalb des Zeitbudgets fertig geworden sind, die gültige mit den wenigsten Farben.
+    Den Prozessen wird nur die kompakte Darstellung des Konfliktgraphen übergeben.
+
+    Wird die Strategie als Kontextmanager verwendet, wird der Prozesspool bei der ersten Färbung gestartet und bis zum
+    Verlassen des Kontexts für alle weiteren Färbungen verwendet; sonst wird für jede Färbung ein eigener gestartet.
+    """
+
+    name = "portfolio"
+
+    def __init__(self, zeitbudget: float = 2.0, prozesse: Optional[int] = None, greedy_seeds: int = 4):
+        """
+        :param zeitbudget: maximale Rechenzeit in Sekunden
+        :param prozesse: Anzahl der Prozesse (``None`` für die Anzahl der Prozessorkerne)
+        :param greedy_seeds: Anzahl der Greedy-Färbungen in zufälliger Reihenfolge
+        """
+        self.zeitbudget = zeitbudget
+        self.prozesse = prozesse
+        self.greedy_seeds = greedy_seeds
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_behalten = False
+
+    def __enter__(self) -> "PortfolioStrategie":
+        self._pool_behalten = True
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._pool_behalten = False
+        if self._pool is not None:
+            # Nicht abwarten, bis noch laufende Strategien fertig sind
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def _pool_starten(self) -> ProcessPoolExecutor:
+        """
+        Startet einen Prozesspool und wartet, bis alle Prozesse bereit sind, damit ihr Start nicht vom Zeitbudget
+        abgeht. Die Prozesse werden neu gestartet statt geforkt, da der Export in einem Thread läuft und ein Fork
+        gehaltene Sperren mitkopieren würde.
+
+        :return: Prozesspool
+        """
+        prozesse = self.prozesse or os.cpu_count() or 1
+        pool = ProcessPoolExecutor(max_workers=prozesse, mp_context=multiprocessing.get_context("spawn"))
+        concurrent.futures.wait([pool.submit(_portfolio_bereit) for _ in range(prozesse)])
+        return pool
+
+    def schluessel(self) -> str:
+        return f"{self.name}:{self.zeitbudget}:{self.greedy_seeds}"
+
+    def strategien(self) -> List[Strategie]:
+        """
+        :return: Strategien, die gleichzeitig ausgeführt werden (bei gleicher Farbanzahl gewinnt die vordere)
+        """
+        # Die Heuristik ist nicht enthalten, da sie die Vorgabe ignoriert und ihre Färbungen daher fast nie gültig sind
+        strategien: List[Strategie] = [
+            # Die exakte Suche bekommt etwas weniger Zeit, damit ihr Ergebnis vor Ablauf des Zeitbudgets vorliegt
+            ExakteStrategie(self.zeitbudget * 0.8),
+            DSaturStrategie(),
+            GreedyStrategie("grad"),
+            GreedyStrategie("index"),
+        ]
+        strategien += [GreedyStrategie("zufall", seed) for seed in range(self.greedy_seeds)]
+        return strategien
+
+    def faerben(self, graph: Konfliktgraph, vorgabe: Dict[int, int]) -> List[int]:
+        pool = self._pool if self._pool is not None else self._pool_starten()
+        if self._pool_behalten:
+            self._pool = pool
+
+        deadline = time.monotonic() + self.zeitbudget
+        kompakt = graph.kompakt()
+        futures = []
+
+        try:
+            futures = [pool.submit(_portfolio_faerben, strategie, kompakt, vorgabe) for strategie in self.strategien()]
+            fertig, _ = concurrent.futures.wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+        finally:
+            # Nicht abwarten, bis noch laufende Strategien fertig sind
+            for future in futures:
+                future.cancel()
+            if pool is not self._pool:
+                pool.shutdown(wait=all(future.done() for future in futures))
+
+        beste: Optional[List[int]] = None
+        for future in futures:
+            if future not in fertig or future.exception() is not None:
+                continue
+            farben = future.result()
+            if _gueltig(graph, farben, vorgabe) and (beste is None or max(farben, default=-1) < max(beste, default=-1)):
+                beste = farben
+
+        if beste is None:
+            # Keine Strategie ist rechtzeitig fertig geworden
+            beste = DSaturStrategie().faerben(graph, vorgabe)
+
+        return beste
+
+
+STRATEGIEN = {
+    HeuristikStrategie.name: HeuristikStrategie,
+    GreedyStrategie.name: GreedyStrategie,
+    DSaturStrategie.name: DSaturStrategie,
+    ExakteStrategie.name: ExakteStrategie,
+    PortfolioStrategie.name: PortfolioStrategie,
+}
+""" Verfügbare Zuordnungsstrategien nach Name """
+
+
+def strategie_aus_config() -> Strategie:
+    """
+    :return: in der Konfiguration (``export``-Abschnitt) festgelegte Zuordnungsstrategie
+    """
+    export_config = config.get("export", {})
+    name = export_config.get("zuordnung", HeuristikStrategie.name)
+    if name not in STRATEGIEN:
+        raise RuntimeError(f"Invalid config file: unknown export.zuordnung value '{name}'")
+
+    if name == ExakteStrategie.name:
+        return ExakteStrategie(export_config.get("zeitbudget", 2.0))
+    if name == PortfolioStrategie.name:
+        return PortfolioStrategie(export_config.get("zeitbudget", 2.0), export_config.get("prozesse", None))
+    # ELSE
+    return STRATEGIEN[name]()
+
+
+def _max_termine() -> Optional[int]:
+    return config.get("export", {}).get("max-termine", None)
+
+
+def inhalt_hash(k_schueler: List, strategie: Strategie) -> str:
+    """
+    Berechnet einen Hash über alles, wovon die Zuordnung abhängt: die Menge der (Klausur-ID, Schüler-ID)-Paare,
+    die Koop- und LK-Eigenschaften sowie die Strategie und die maximale Terminanzahl.
+
+    :param k_schueler: Liste der nachzuschreibenden Klausurteilnahmen
+    :param strategie: zu verwendende Strategie
+    :return: SHA-256-Hash als Hexadezimalstring
+    """
+    paare = sorted((kt.klausur_id, kt.schueler_id, bool(kt.koop), ist_lk([kt])) for kt in k_schueler)
+    sha = hashlib.sha256(f"{strategie.schluessel()}|{_max_termine()}".encode("utf-8"))
+    for paar in paare:
+        sha.update(("|%d,%d,%d,%d" % paar).encode("ascii"))
+    return sha.hexdigest()
+
+
+def kurs_termine_berechnen(k_schueler: List, strategie: Optional[Strategie] = None,
+                           graph: Optional[Konfliktgraph] = None) -> Dict[int, int]:
+    """
+    Ordnet die Klausuren der nachzuschreibenden Klausurteilnahmen Nachschreibterminen zu.
+    Kurse mit Koopschülern und Leistungskurse kommen dabei, soweit möglich, in Termin 1.
+    Klausuren, die nicht innerhalb der konfigurierten maximalen Terminanzahl (``export.max-termine``)
+    untergebracht werden können, sind nicht enthalten.
+
+    :param k_schueler: Liste der nachzuschreibenden Klausurteilnahmen
+    :param strategie: zu verwendende Strategie (Voreinstellung: aus der Konfiguration)
+    :param graph: bereits erstellter Konfliktgraph für ``k_schueler`` (wird sonst erstellt)
+    :return: Dictionary, das Klausur-IDs ihren Termin (beginnend bei 0) zuordnet
+    """
+    if strategie is None:
+        strategie = strategie_aus_config()
+
+    if graph is None:
+        graph = konfliktgraph_erstellen(k_schueler)
+
+    farben = strategie.faerben(graph, vorgabe_erstellen(graph))
+    max_termine = _max_termine()
+
+    return {kurs[0].klausur_id: farbe for kurs, farbe in zip(graph.kurse, farben)
+            if max_termine is None or farbe < max_termine}
+
+
+def termine_erstellen(k_schueler: List, kurs_termine: Dict[int, int]) -> List[List]:
+    """
+    Wandelt eine Zuordnung von Klausur-IDs zu Terminen in eine Liste von Terminen
+    mit den jeweils zugeordneten Klausurteilnahmen um.
+    """
+    termine: List[List] = [[] for _ in range(max(kurs_termine.values(), default=-1) + 1)]
+    for kt in k_schueler:
+        termin = kurs_termine.get(kt.klausur_id)
+        if termin is not None:
+            termine[termin].append(kt)
+    return termine
+
+
+def termin_nummern(k_schueler: List, kurs_termine: Dict[int, int]) -> Dict[Tuple[int, int], int]:
+    """
+    Erstellt aus einer Zuordnung von Klausur-IDs zu Terminen ein Dictionary für das direkte Nachschlagen
+    des Termins einer Klausurteilnahme.
+
+    :param k_schueler: Liste der nachzuschreibenden Klausurteilnahmen
+    :param kurs_termine: Dictionary, das Klausur-IDs ihren Termin (beginnend bei 0) zuordnet
+    :return: Dictionary, das (Klausur-ID, Schüler-ID)-Paaren die Nummer ihres Termins (beginnend bei 1) zuordnet.
+        Teilnahmen ohne Termin sind nicht enthalten.
+    """
+    return {(kt.klausur_id, kt.schueler_id): kurs_termine[kt.klausur_id] + 1
+            for kt in k_schueler if kt.klausur_id in kurs_termine}
+
+
+def zuordnen(k_schueler: List, strategie: Optional[Strategie] = None,
+             graph: Optional[Konfliktgraph] = None) -> Optional[List[List]]:
+    """
+    Ordnet die nachzuschreibenden Klausurteilnahmen Nachschreibterminen zu (siehe :func:`kurs_termine_berechnen`).
+    Teilnahmen an Klausuren ohne Termin sind in keinem Termin enthalten.
+
+    :param k_schueler: Liste der nachzuschreibenden Klausurteilnahmen
+    :param strategie: zu verwendende Strategie (Voreinstellung: aus der Konfiguration)
+    :param graph: bereits erstellter Konfliktgraph für ``k_schueler`` (wird sonst erstellt)
+    :return: Liste von Terminen mit den jeweils zugeordneten Klausurteilnahmen oder ``None``,
+        falls keine Klausurteilnahmen angegeben wurden
+    """
+    if len(k_schueler) == 0:
+        return None
+
+    return termine_erstellen(k_schueler, kurs_termine_berechnen(k_schueler, strategie, graph))
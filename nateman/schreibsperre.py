@@ -0,0 +1,157 @@
+# NateMan – Nachschreibtermin-Manager
+# schreibsperre.py
+# Copyright © 2020  Niklas Elsbrock
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Optionale Schreibsperre für SQLite (Einstellung ``database.schreibsperre``).
+
+SQLite erlaubt nur eine schreibende Transaktion gleichzeitig. Wollen mehrere Anfragen gleichzeitig schreiben, wartet
+SQLite, indem es den Zugriff in immer größeren Abständen erneut versucht (``busy_timeout``), sodass die Wartezeiten
+schwer vorhersehbar sind und nach Ablauf der Wartezeit ``database is locked`` auftritt.
+
+Mit der Schreibsperre werden schreibende Transaktionen stattdessen nacheinander ausgeführt: Vor der ersten
+schreibenden Anweisung einer Transaktion (mit der das sqlite3-Modul die Transaktion beginnt) wird eine Sperre
+angefordert, die freigegeben wird, sobald die Verbindung nach dem Commit bzw. Rollback in den Pool zurückgegeben wird.
+Innerhalb eines Prozesses wird dafür eine ``threading.Lock`` verwendet, auf die wartende Anfragen blockierend
+warten. Zwischen mehreren Prozessen (z.B. Gunicorn-Workern) wird zusätzlich eine per ``flock`` gesperrte Datei neben
+der Datenbank verwendet; da ``flock`` keine Wartezeit kennt, wird sie in kurzen Abständen erneut angefordert.
+"""
+
+import re
+import threading
+import time
+from typing import Optional
+
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .config_manager import config
+
+try:
+    import fcntl
+except ImportError:  # z.B. unter Windows, dort werden nur die Threads eines Prozesses nacheinander ausgeführt
+    fcntl = None
+
+_SCHREIBEND = re.compile(r"\s*(INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+""" Anweisungen, vor denen das sqlite3-Modul eine Transaktion beginnt """
+
+_INFO_KEY = "schreibsperre"
+
+_WARTEINTERVALL = 0.005
+""" Abstand in Sekunden, in dem die von einem anderen Prozess gehaltene Sperrdatei erneut angefordert wird """
+
+
+class Schreibsperre:
+    """
+    Sperre, die jeweils nur eine schreibende Transaktion auf die Datenbank zulässt.
+
+    Da eine Verbindung auch in einem anderen Thread in den Pool zurückgegeben werden kann, als in dem sie die Sperre
+    angefordert hat, wird eine (nicht wiedereintrittsfähige) ``threading.Lock`` verwendet. Damit ein Thread, der die
+    Sperre bereits über eine andere Verbindung hält, nicht dauerhaft wartet, wird nach ``timeout`` Sekunden ohne die
+    Sperre fortgefahren; SQLite regelt den Zugriff dann wie ohne Schreibsperre. Dieselbe Wartezeit gilt insgesamt
+    auch für die Sperrdatei, falls ein anderer Prozess die Sperre hält.
+    """
+
+    def __init__(self, datei_pfad: Optional[str], timeout: float):
+        """
+        :param datei_pfad: Pfad der Sperrdatei für mehrere Prozesse oder ``None``
+        :param timeout: maximale Wartezeit auf die Sperre innerhalb eines Prozesses in Sekunden
+        """
+        self._lock = threading.Lock()
+        self._timeout = timeout
+        self._datei = open(datei_pfad, "a") if datei_pfad is not None and fcntl is not None else None
+
+    def anfordern(self) -> bool:
+        """
+        Wartet, bis die Sperre frei ist, und belegt sie.
+
+        :return: ``True``, falls die Sperre belegt wurde, ``False``, falls die Wartezeit abgelaufen ist
+        """
+        deadline = time.monotonic() + self._timeout
+        if not self._lock.acquire(timeout=self._timeout):
+            return False
+
+        # ELSE
+
+        if self._datei is not None and not self._datei_sperren(deadline):
+            self._lock.release()
+            return False
+
+        return True
+
+    def _datei_sperren(self, deadline: float) -> bool:
+        """
+        Sperrt die Sperrdatei und versucht es dazu bis ``deadline`` regelmäßig erneut.
+
+        :param deadline: Zeitpunkt (``time.monotonic()``), bis zu dem gewartet wird
+        :return: ``True``, falls die Sperrdatei gesperrt wurde, ``False``, falls die Wartezeit abgelaufen ist
+        """
+        while True:
+            try:
+                fcntl.flock(self._datei, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(_WARTEINTERVALL)
+
+    def freigeben(self) -> None:
+        """
+        Gibt die Sperre frei.
+        """
+        if self._datei is not None:
+            fcntl.flock(self._datei, fcntl.LOCK_UN)
+        self._lock.release()
+
+
+def einrichten(app: Flask, engine: Engine) -> Optional[Schreibsperre]:
+    """
+    Richtet die Schreibsperre für die Datenbank ein, falls sie in der Konfiguration aktiviert ist und SQLite verwendet
+    wird.
+
+    :param app: Flask-App
+    :param engine: Engine der Datenbank
+    :return: Schreibsperre oder ``None``
+    """
+    database_config = config.get("database") or {}
+    if not database_config.get("schreibsperre", False) or engine.dialect.name != "sqlite":
+        return None
+
+    # ELSE
+
+    datenbank = engine.url.database
+    datei_pfad = datenbank + ".schreibsperre" if datenbank and datenbank != ":memory:" else None
+    timeout = (database_config.get("busy-timeout") or 5000) / 1000
+    sperre = Schreibsperre(datei_pfad, timeout)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def vor_schreibzugriff(connection, cursor, statement, parameters, context, executemany):
+        if _INFO_KEY not in connection.info and _SCHREIBEND.match(statement):
+            if sperre.anfordern():
+                connection.info[_INFO_KEY] = True
+            else:
+                app.logger.warning("Die Schreibsperre konnte nicht rechtzeitig belegt werden, es wird ohne sie "
+                                   "fortgefahren.")
+
+    @event.listens_for(engine.pool, "checkin")
+    @event.listens_for(engine.pool, "invalidate")
+    def nach_transaktion(dbapi_connection, connection_record, *args):
+        if connection_record is not None and connection_record.info.pop(_INFO_KEY, False):
+            sperre.freigeben()
+
+    app.logger.info("Schreibzugriffe auf die Datenbank werden nacheinander ausgeführt (Schreibsperre).")
+    return sperre
@@ -0,0 +1,167 @@
+# NateMan – Nachschreibtermin-Manager
+# stammdaten.py
+# Copyright © 2020  Niklas Elsbrock
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Zwischenspeicher für die Stufen und die Lehrerliste, die auf fast jeder Seite (Navigation, Auswahllisten) benötigt
+werden.
+
+Die Daten werden im Speicher des Prozesses gehalten, solange sich die :class:`models.Datenversion` nicht ändert. Sie
+wird in derselben Transaktion erhöht, in der Stufen oder Lehrer (Kürzel) geändert werden, sodass auch andere Prozesse
+die Änderung bemerken. Die Version wird erst abgefragt, wenn die Stammdaten benötigt werden, und dann pro Anfrage
+nur einmal; da die Navigation die Stufen enthält, ist das bei fast jeder Seite eine Abfrage.
+"""
+
+import threading
+from datetime import date
+from typing import NamedTuple, Optional, Tuple
+
+from flask import g, has_app_context
+from sqlalchemy.orm import Session as OrmSession
+
+from .models import Datenversion, Lehrer, Stufe, db
+
+
+class StufeDaten(NamedTuple):
+    name: str
+    import_date: Optional[date]
+    import_zusammenfassung: Optional[str]
+
+
+class LehrerDaten(NamedTuple):
+    id: int
+    kuerzel: str
+
+
+class _Stammdaten(NamedTuple):
+    schluessel: Tuple[str, int]  # Datenbank-URI und Datenversion
+    stufen: Tuple[StufeDaten, ...]
+    lehrer: Tuple[LehrerDaten, ...]
+
+
+_DATENVERSION_ID = 1
+_SESSION_INFO_KEY = "datenversion_erhoeht"
+
+_cache: Optional[_Stammdaten] = None
+_cache_lock = threading.Lock()
+
+
+def stufen() -> Tuple[StufeDaten, ...]:
+    """
+    :return: alle Stufen
+    """
+    return _stammdaten().stufen
+
+
+def lehrer() -> Tuple[LehrerDaten, ...]:
+    """
+    :return: alle Lehrer, nach Kürzel sortiert
+    """
+    return _stammdaten().lehrer
+
+
+def _stammdaten() -> _Stammdaten:
+    global _cache
+
+    # Eigene, noch nicht gespeicherte Änderungen dürfen nicht in den Zwischenspeicher gelangen
+    if db.session.info.get(_SESSION_INFO_KEY, False):
+        return _laden(("", -1))
+
+    # ELSE
+
+    schluessel = (str(db.engine.url), _datenversion())
+    cache = _cache
+    if cache is not None and cache.schluessel == schluessel:
+        return cache
+
+    # ELSE
+
+    with _cache_lock:
+        if _cache is None or _cache.schluessel != schluessel:
+            _cache = _laden(schluessel)
+        return _cache
+
+
+def _laden(schluessel: Tuple[str, int]) -> _Stammdaten:
+    stufen_ = tuple(StufeDaten._make(row) for row in db.session.query(
+        Stufe.name, Stufe.import_date, Stufe.import_zusammenfassung))
+    lehrer_ = tuple(LehrerDaten._make(row) for row in db.session.query(Lehrer.id, Lehrer.kuerzel)
+                    .order_by(Lehrer.kuerzel))
+    return _Stammdaten(schluessel, stufen_, lehrer_)
+
+
+def _datenversion() -> int:
+    """
+    :return: aktuelle Datenversion (während einer Anfrage nur einmal abgefragt)
+    """
+    if has_app_context() and "datenversion" in g:
+        return g.datenversion
+
+    # ELSE
+
+    version = db.session.query(Datenversion.version).filter_by(id=_DATENVERSION_ID).scalar() or 0
+    if has_app_context():
+        g.datenversion = version
+    return version
+
+
+def datenversion_erhoehen(session: OrmSession = None) -> None:
+    """
+    Erhöht die Datenversion in der aktuellen Transaktion, sodass alle Prozesse die Stammdaten neu laden.
+    Bei Änderungen über das ORM geschieht dies automatisch (siehe :func:`stammdaten_geaendert`).
+
+    :param session: Sitzung, in deren Transaktion die Version erhöht wird (Standard: ``db.session``)
+    """
+    session = session if session is not None else db.session
+    if session.execute(db.update(Datenversion).where(Datenversion.id == _DATENVERSION_ID)
+                       .values(version=Datenversion.version + 1)).rowcount == 0:
+        session.add(Datenversion(id=_DATENVERSION_ID, version=1))
+
+    session.info[_SESSION_INFO_KEY] = True
+    if has_app_context():
+        g.pop("datenversion", None)
+
+
+@db.event.listens_for(OrmSession, "before_flush")
+def stammdaten_geaendert(session, flush_context, instances):
+    """
+    Erhöht die Datenversion, falls Stufen hinzugefügt, geändert oder gelöscht werden oder sich die Lehrerliste
+    (Lehrer oder deren Kürzel) ändert.
+    """
+    if session.info.get(_SESSION_INFO_KEY, False):
+        return
+
+    # ELSE
+
+    for obj in (*session.new, *session.deleted):
+        if isinstance(obj, (Stufe, Lehrer)):
+            datenversion_erhoehen(session)
+            return
+
+    for obj in session.dirty:
+        if (isinstance(obj, Stufe) and session.is_modified(obj)) \
+                or (isinstance(obj, Lehrer) and db.inspect(obj).attrs.kuerzel.history.has_changes()):
+            datenversion_erhoehen(session)
+            return
+
+
+@db.event.listens_for(OrmSession, "after_transaction_end")
+def stammdaten_transaktion_beendet(session, transaction):
+    """
+    Nach dem Ende der Transaktion dürfen die Stammdaten wieder zwischengespeichert werden.
+    """
+    if transaction.parent is None:
+        session.info.pop(_SESSION_INFO_KEY, None)
@@ -12,14 +12,16 @@ setup(
     packages=find_packages(),
     include_package_data=True,
     zip_safe=False,
-    python_requires="~=3.6",
+    python_requires=">=3.7",
     install_requires=[
-        "Flask",
-        "Flask-SQLAlchemy>=2.0.0",
+        "Flask>=2.0",
+        "Flask-SQLAlchemy>=3.0",
+        "SQLAlchemy>=1.4.40",
         "Click",
         "PyYAML",
         "bcrypt",
         "openpyxl"
     ],
+    extras_require={"numpy": ["numpy"], "postgresql": ["psycopg2"]},
     entry_points={"console_scripts": ["nateman = nateman.commands:cli"]}
 )